@@ -123,7 +123,8 @@ class TaskWidget(QWidget):
         if self.ui.ready():
             if task.stop:
                 logging.debug('User requests testing of stop Task %s', task.name)
-                TaskManager.stop_task(task)
+                # Runs on the UI thread, do not wait for the process to close gracefully
+                TaskManager.stop_task(task, graceful=False)
             else:
                 logging.debug('User requests testing of start Task %s', task.name)
                 TaskManager.start_task(task)
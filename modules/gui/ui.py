@@ -9,7 +9,10 @@ from qtpy.QtWidgets import QAction, QLabel, QMainWindow, QPushButton, QTabWidget
 from sqlalchemy.event import listens_for
 from sqlalchemy.orm import Session
 
+from shared_modules.changelog import data_version, session_execute
 from shared_modules.models import Profile
+from shared_modules.rules_file import write_rules_file
+from shared_modules.utils import load_profiles
 from .addprofilemenu import AddProfileMenu
 from .expandable_widget import ExpandableWidget
 from .file_dialog import FileDialog
@@ -108,6 +111,7 @@ class SimmonUi(QMainWindow):
         self.create_widgets()
 
         self.install_event()
+        self.export_rules()
         self._ready_to_quit = False
         self.start_shutdown.connect(self._shutdown)
 
@@ -152,8 +156,21 @@ class SimmonUi(QMainWindow):
     def update_watcher(self):
         """ Tell Watcher to re-read database """
         logging.debug('Watcher re-read triggered. Database updates detected.')
+        self.export_rules()
         self.watch_controller.restart_watcher()
 
+    def export_rules(self):
+        """ Export the compiled rules file the Watcher reads instead of the database """
+        session = Session(self.app.db_engine)
+        try:
+            version = data_version(session_execute(session))
+            write_rules_file(load_profiles(session), version)
+        except Exception as e:
+            # Watcher falls back to reading the database
+            logging.error('Could not export rules file: %s', e)
+        finally:
+            session.close()
+
     def ready(self):
         """ Check if Ui was updated within last debounce interval or
             start new debounce interval.
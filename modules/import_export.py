@@ -3,7 +3,7 @@ import logging
 from pathlib import Path, WindowsPath
 
 from modules.steam_utils import SteamApps
-from shared_modules import Condition, Gate, Process, Profile, Task
+from shared_modules.models import Condition, Gate, Process, Profile, Task
 from shared_modules.migrate import Session
 
 
@@ -45,7 +45,7 @@ class ProfileImportExport:
 
         # Do not alter entries that already have a valid path
         exe_path = Path(Path(entry.path) / entry.executable)
-        if exe_path.is_file() and exe_path.exists():
+        if exe_path.is_file():
             return
 
         if entry.executable in cls.known_app_executables:
@@ -0,0 +1,133 @@
+""" Batch evaluation of task conditions with bitsets.
+
+    Every condition process (executable name and path) gets a bit. The terms of the condition
+    expression of a task are compiled to a disjunction of groups, each with a mask of processes
+    required to run and a mask of processes required not to run. The running state of all condition processes is one
+    bitset, so checking a task is a few integer operations per group.
+"""
+import logging
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from .rules import ConditionRule, ProcessRule, TaskRule
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# (required running mask, required not running mask)
+Group = Tuple[int, int]
+
+
+class ConditionBitsets:
+    """ Conditions of all tasks of a RuleIndex compiled to bitmasks, built once per reload """
+    __slots__ = ('bits', 'processes', 'groups', 'used', '_arrays')
+
+    # -- Evaluate with NumPy arrays if available, pays off for thousands of condition groups
+    use_numpy = False
+
+    def __init__(self, tasks: Iterable['TaskRule']):
+        # -- Bit index of each condition process
+        self.bits: Dict[Tuple[str, str], int] = dict()
+        self.processes: List['ProcessRule'] = list()
+
+        # -- Condition groups and the mask of all bits used by a task, by task id
+        self.groups: Dict[int, Tuple[Group, ...]] = dict()
+        self.used: Dict[int, int] = dict()
+
+        for task in tasks:
+            groups = self._compile(task)
+            self.groups[task.id] = groups
+            used = 0
+            for running, not_running in groups:
+                used |= running | not_running
+            self.used[task.id] = used
+
+        self._arrays = self._build_arrays() if self.use_numpy and numpy is not None else None
+
+    def _bit(self, process: 'ProcessRule') -> int:
+        key = (process.executable.casefold(), process.path)
+        if key not in self.bits:
+            self.bits[key] = len(self.processes)
+            self.processes.append(process)
+        return 1 << self.bits[key]
+
+    def _literal(self, condition: 'ConditionRule') -> Group:
+        bit = self._bit(condition.process)
+        return (bit, 0) if condition.running else (0, bit)
+
+    def _compile(self, task: 'TaskRule') -> Tuple[Group, ...]:
+        """ Compile the terms of the task's condition expression to bitmasks """
+        groups = list()
+        for term in task.expression.terms:
+            running, not_running = 0, 0
+            for condition in term:
+                r, n = self._literal(condition)
+                running, not_running = running | r, not_running | n
+            groups.append((running, not_running))
+
+        # Groups requiring a process to run and not to run at once can never be met
+        return tuple(g for g in groups if not g[0] & g[1])
+
+    def state(self, mask: int, is_running: Callable[[str], bool]) -> int:
+        """ Build the running state of the condition processes in mask.
+            A process whose executable did not exist at compile time counts as not running.
+        """
+        state, idx = 0, 0
+        while mask:
+            if mask & 1:
+                process = self.processes[idx]
+                if process.exists and is_running(process.executable):
+                    state |= 1 << idx
+            mask >>= 1
+            idx += 1
+        return state
+
+    def evaluate(self, tasks: Sequence['TaskRule'], is_running: Callable[[str], bool]) -> List[bool]:
+        """ Evaluate the conditions of all tasks in one pass
+
+        :returns: for each task True if its conditions are met
+        """
+        used = 0
+        for task in tasks:
+            used |= self.used.get(task.id, 0)
+        state = self.state(used, is_running)
+
+        if self._arrays is not None:
+            return self._evaluate_numpy(tasks, state)
+
+        results = list()
+        for task in tasks:
+            groups = self.groups.get(task.id, ())
+            results.append(any((state & r) == r and not state & n for r, n in groups))
+        return results
+
+    def _build_arrays(self):
+        """ Boolean matrices of all groups: required running, required not running and their task id """
+        num_bits = max(len(self.processes), 1)
+        rows = [(task_id, r, n) for task_id, groups in self.groups.items() for r, n in groups]
+
+        running = numpy.zeros((len(rows), num_bits), dtype=bool)
+        not_running = numpy.zeros((len(rows), num_bits), dtype=bool)
+        for row, (_, r, n) in enumerate(rows):
+            running[row] = self._unpack(r, num_bits)
+            not_running[row] = self._unpack(n, num_bits)
+
+        task_ids = numpy.array([task_id for task_id, _, _ in rows], dtype=numpy.int64)
+        logging.debug('Compiled %s condition groups of %s processes to arrays', len(rows), num_bits)
+        return running, not_running, task_ids, num_bits
+
+    @staticmethod
+    def _unpack(mask: int, num_bits: int):
+        return numpy.array([(mask >> idx) & 1 for idx in range(num_bits)], dtype=bool)
+
+    def _evaluate_numpy(self, tasks: Sequence['TaskRule'], state: int) -> List[bool]:
+        running, not_running, task_ids, num_bits = self._arrays
+        s = self._unpack(state, num_bits)
+
+        # A group is met if no required process is missing and no forbidden process runs
+        met = ~(running & ~s).any(axis=1) & ~(not_running & s).any(axis=1)
+        met_ids = set(task_ids[met].tolist())
+        return [task.id in met_ids for task in tasks]
+
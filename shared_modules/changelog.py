@@ -0,0 +1,84 @@
+""" Read the data version and the changed profiles from the changelog table.
+
+    Works on raw sqlite3 connections, also the one underneath a SQLAlchemy session, so the watcher
+    can check for changes without importing SQLAlchemy.
+"""
+import logging
+import sqlite3
+from pathlib import Path
+from typing import Any, Callable, Optional, Set
+
+from .globals import get_database_file
+
+# -- Execute a statement with qmark parameters, eg. sqlite3.Connection.execute
+Execute = Callable[..., Any]
+
+
+def session_execute(session) -> Execute:
+    """ Execute statements on the sqlite3 connection of a SQLAlchemy session, within its transaction """
+    dbapi_connection = session.connection().connection
+
+    def execute(*args):
+        # sqlite3 cursors return themselves from execute
+        return dbapi_connection.cursor().execute(*args)
+
+    return execute
+
+
+def data_version(execute: Execute) -> int:
+    """ Version of the profile data, increases with every change """
+    return execute('SELECT MAX(id) FROM changelog').fetchone()[0] or 0
+
+
+def changed_profiles(execute: Execute, since: int, until: int) -> Optional[Set[int]]:
+    """ Ids of the profiles changed after data version since up to version until
+
+    :returns: the profile ids or None if the changelog does not reach back to since
+    """
+    if until < since:
+        # Database was replaced
+        return None
+    if until == since:
+        return set()
+
+    oldest = execute('SELECT MIN(id) FROM changelog').fetchone()[0]
+    if oldest is None or oldest > since + 1:
+        return None
+
+    rows = execute('SELECT DISTINCT profile_id FROM changelog WHERE id > ? AND id <= ?', (since, until)).fetchall()
+    return {r[0] for r in rows}
+
+
+def _connect(database_file: Path = None) -> Optional[sqlite3.Connection]:
+    database_file = database_file or get_database_file()
+    if not database_file.is_file():
+        return None
+    return sqlite3.connect(database_file.as_posix())
+
+
+def read_data_version(database_file: Path = None) -> Optional[int]:
+    """ Data version of the database file, None if it can not be read """
+    try:
+        connection = _connect(database_file)
+        if connection is None:
+            return None
+        try:
+            return data_version(connection.execute)
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logging.debug('Could not read data version: %s', e)
+
+
+def read_changed_profiles(since: int, until: int, database_file: Path = None) -> Optional[Set[int]]:
+    """ Ids of the profiles changed between two data versions of the database file, None if unknown """
+    try:
+        connection = _connect(database_file)
+        if connection is None:
+            return None
+        try:
+            return changed_profiles(connection.execute, since, until)
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logging.debug('Could not read changelog: %s', e)
@@ -75,3 +75,15 @@ SQLALCHEMY_DATABASE_URI = f'sqlite:///{get_settings_dir().resolve().as_posix()}\
 
 def get_database_url():
     return SQLALCHEMY_DATABASE_URI
+
+
+def get_database_file() -> Path:
+    return Path(SQLALCHEMY_DATABASE_URI[len('sqlite:///'):])
+
+
+RULES_FILE_NAME = f'{SETTINGS_DIR_NAME}_rules.json'
+
+
+def get_rules_file() -> Path:
+    """ Compiled profile rules exported by the GUI for the watcher """
+    return get_settings_dir() / RULES_FILE_NAME
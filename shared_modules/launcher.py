@@ -0,0 +1,244 @@
+import asyncio
+import enum
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, List, NamedTuple, Optional, Set, Tuple, Union
+
+from .rules import TaskRule
+from .terminator import is_pid_running
+
+if TYPE_CHECKING:
+    from .models import Task
+
+
+class LaunchResult(NamedTuple):
+    task_id: int
+    task_name: str
+    stop: bool
+    success: bool
+    # Seconds the start or stop took
+    duration: float
+    error: str = ''
+    # Process id of a started process
+    pid: int = 0
+
+
+# (success, pid of the started process or 0)
+Outcome = Tuple[bool, int]
+
+
+def _worker_init():
+    # WMI used to stop tasks needs COM set up in every thread
+    if sys.platform == 'win32':
+        import pythoncom
+        pythoncom.CoInitialize()
+
+
+class TaskLauncher:
+    """ Start and stop task processes in worker threads so the event loop never blocks on them.
+
+        Independent tasks are launched concurrently. Stop tasks may be handed over together to one
+        batch callable so their processes are stopped within one timeout window. In ordered mode
+        tasks are launched one after another in the given order with ordered_delay_secs in between.
+    """
+    # -- Worker threads launching processes
+    max_workers = 4
+
+    # -- Seconds between two launches in ordered mode
+    ordered_delay_secs = 0.1
+
+    def __init__(self, ordered: bool = False):
+        self.ordered = ordered
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='TaskLauncher',
+                                                initializer=_worker_init)
+        return self._executor
+
+    def _launch_blocking(self, task: Union['Task', TaskRule], execute: Callable[[Union['Task', TaskRule]], Outcome]) \
+            -> LaunchResult:
+        start, error, pid = time.perf_counter(), '', 0
+        try:
+            success, pid = execute(task)
+        except Exception as e:
+            success, error = False, str(e)
+            logging.error('Error executing task %s: %s', task.name, e)
+
+        return LaunchResult(task.id, task.name, bool(task.stop), success, time.perf_counter() - start, error, pid)
+
+    @staticmethod
+    def _launch_batch_blocking(tasks: List[Union['Task', TaskRule]],
+                               execute: Callable[[List[Union['Task', TaskRule]]], List[Outcome]]) -> List[LaunchResult]:
+        start = time.perf_counter()
+        try:
+            outcomes, error = execute(tasks), ''
+        except Exception as e:
+            outcomes, error = [(False, 0)] * len(tasks), str(e)
+            logging.error('Error executing tasks %s: %s', ', '.join(t.name for t in tasks), e)
+
+        duration = time.perf_counter() - start
+        return [LaunchResult(t.id, t.name, bool(t.stop), success, duration, error, pid)
+                for t, (success, pid) in zip(tasks, outcomes)]
+
+    async def _launch_concurrent(self, loop: asyncio.AbstractEventLoop, tasks: List[Union['Task', TaskRule]],
+                                 execute: Callable[[Union['Task', TaskRule]], Outcome],
+                                 execute_stops: Optional[Callable[[List[Union['Task', TaskRule]]], List[Outcome]]]) \
+            -> List[LaunchResult]:
+        executor = self._get_executor()
+        batch = [idx for idx, t in enumerate(tasks) if t.stop] if execute_stops is not None else list()
+        single = [idx for idx in range(len(tasks)) if idx not in batch]
+
+        launches = [loop.run_in_executor(executor, self._launch_blocking, tasks[idx], execute) for idx in single]
+        if batch:
+            launches.append(loop.run_in_executor(executor, self._launch_batch_blocking, [tasks[idx] for idx in batch],
+                                                 execute_stops))
+        done = await asyncio.gather(*launches)
+
+        # -- Report in the order of the tasks
+        results: List[Optional[LaunchResult]] = [None] * len(tasks)
+        for idx, result in zip(single, done):
+            results[idx] = result
+        if batch:
+            for idx, result in zip(batch, done[-1]):
+                results[idx] = result
+        return results
+
+    async def _launch_ordered(self, loop: asyncio.AbstractEventLoop, tasks: List[Union['Task', TaskRule]],
+                              execute: Callable[[Union['Task', TaskRule]], Outcome]) -> List[LaunchResult]:
+        results = list()
+        for idx, task in enumerate(tasks):
+            if idx:
+                await asyncio.sleep(self.ordered_delay_secs)
+            results.append(await loop.run_in_executor(self._get_executor(), self._launch_blocking, task, execute))
+        return results
+
+    async def launch(self, tasks: List[Union['Task', TaskRule]], execute: Callable[[Union['Task', TaskRule]], Outcome],
+                     execute_stops: Callable[[List[Union['Task', TaskRule]]], List[Outcome]] = None) \
+            -> List[LaunchResult]:
+        """ Launch tasks and report the outcome of each launch.
+            Launches in progress are finished before a cancellation of the caller propagates.
+
+        :param tasks: tasks to start or stop
+        :param execute: blocking callable starting or stopping one task, returns success and started pid
+        :param execute_stops: blocking callable stopping several tasks at once, used for all stop tasks if set
+        """
+        if not tasks:
+            return list()
+
+        loop = asyncio.get_running_loop()
+        if self.ordered:
+            launch = asyncio.ensure_future(self._launch_ordered(loop, tasks, execute))
+        else:
+            launch = asyncio.ensure_future(self._launch_concurrent(loop, tasks, execute, execute_stops))
+
+        try:
+            return list(await asyncio.shield(launch))
+        except asyncio.CancelledError:
+            await launch
+            raise
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class LaunchState(enum.Enum):
+    IDLE = 'idle'
+    LAUNCHING = 'launching'
+    RUNNING = 'running'
+    STOPPED = 'stopped'
+
+
+class _Launch:
+    __slots__ = ('state', 'pids', 'last_launch')
+
+    def __init__(self):
+        self.state = LaunchState.IDLE
+        self.pids: Set[int] = set()
+        self.last_launch = float('-inf')
+
+
+class LaunchTracker:
+    """ Launch state of tasks: idle -> launching -> running -> stopped.
+
+        Tasks starting the same executable share one state unless they allow multiple instances, so
+        several profiles hit by the same sim launch a follow-up app once. A task is not launched again
+        while its launch is in progress, while a process we started for it is running or within
+        cooldown_secs of a launch whose outcome we can not follow. Started processes are tracked by pid
+        until their deletion event arrives or they are found to have exited when the task is claimed
+        again, the task may be launched again at once after that. Not thread-safe, use it from the
+        Watchlet event loop only.
+    """
+    # -- Seconds after a failed or untracked launch in which the same task will not be launched again,
+    #    covers the time until a started process becomes visible
+    cooldown_secs = 10.0
+
+    def __init__(self):
+        self._launches: Dict[Hashable, _Launch] = dict()
+
+    @staticmethod
+    def key(task: Union['Task', TaskRule]) -> Hashable:
+        executable = (task.process.executable or '').casefold()
+        if task.stop:
+            return 'stop', executable
+        if task.allow_multiple_instances:
+            return 'task', task.id
+        return 'start', executable
+
+    def state(self, task: Union['Task', TaskRule]) -> LaunchState:
+        launch = self._launches.get(self.key(task))
+        return launch.state if launch is not None else LaunchState.IDLE
+
+    def claim(self, task: Union['Task', TaskRule]) -> str:
+        """ Enter the launching state if the task may be launched now
+
+        :returns: the reason why the task may not be launched, empty if it was claimed
+        """
+        launch = self._launches.setdefault(self.key(task), _Launch())
+
+        if launch.state == LaunchState.LAUNCHING:
+            return 'launch in progress'
+        if launch.state == LaunchState.RUNNING:
+            # - Deletion events are missed for processes not watched or exiting while the watcher restarted
+            launch.pids = {pid for pid in launch.pids if is_pid_running(pid)}
+            if launch.pids:
+                return f'started process still running: {", ".join(str(p) for p in sorted(launch.pids))}'
+            launch.state, launch.last_launch = LaunchState.STOPPED, float('-inf')
+        remaining = launch.last_launch + self.cooldown_secs - time.monotonic()
+        if remaining > 0:
+            return f'launched {self.cooldown_secs - remaining:.1f}s ago, cooldown {self.cooldown_secs:g}s'
+
+        launch.state, launch.last_launch = LaunchState.LAUNCHING, time.monotonic()
+        return ''
+
+    def finish(self, task: Union['Task', TaskRule], success: bool, pid: int = 0):
+        """ Leave the launching state with the outcome of the launch """
+        launch = self._launches.setdefault(self.key(task), _Launch())
+
+        if task.stop:
+            launch.state = LaunchState.STOPPED if success else LaunchState.IDLE
+            if success:
+                launch.last_launch = float('-inf')
+                # - We stopped the app, processes we started for it are gone and it may be started again
+                started = self._launches.get(('start', (task.process.executable or '').casefold()))
+                if started is not None and started.state != LaunchState.LAUNCHING:
+                    started.state, started.pids, started.last_launch = LaunchState.STOPPED, set(), float('-inf')
+        elif success and pid:
+            launch.state = LaunchState.RUNNING
+            launch.pids.add(pid)
+        else:
+            # - Failed or untracked launches only block relaunches for the cooldown
+            launch.state = LaunchState.IDLE
+
+    def process_exited(self, pid: int):
+        """ Update the state of tasks whose started process exited """
+        for launch in self._launches.values():
+            if pid in launch.pids:
+                launch.pids.discard(pid)
+                if not launch.pids and launch.state == LaunchState.RUNNING:
+                    launch.state, launch.last_launch = LaunchState.STOPPED, float('-inf')
@@ -1,12 +1,14 @@
+import logging
 import os
-from pathlib import Path, WindowsPath
+import re
+import sqlite3
+from pathlib import Path
+from typing import Optional, Set
 
 import sqlalchemy as db
-from alembic import command, context
-from alembic.config import Config as AlembicConfig
 from sqlalchemy.orm import scoped_session, sessionmaker
 
-from .globals import SQLALCHEMY_DATABASE_URI, get_current_modules_dir
+from .globals import SQLALCHEMY_DATABASE_URI, get_current_modules_dir, get_database_file
 from .models import *
 from .models import Base
 from . import SimmonAppState
@@ -17,63 +19,154 @@ SimmonAppState.is_running = True
 
 current_dir = Path(get_current_modules_dir()) / 'migrate'
 alembic_ini_path = Path(get_current_modules_dir()) / 'alembic.ini'
-ALEMBIC_INI = str(WindowsPath(alembic_ini_path))
-MIGRATION_DIR = str(WindowsPath(current_dir))
+ALEMBIC_INI = str(alembic_ini_path)
+MIGRATION_DIR = str(current_dir)
 
+# -- Alembic is only imported if the schema needs to be migrated
+_config = None
 
-class Config(AlembicConfig):
-    def get_template_directory(self):
-        return os.path.join(MIGRATION_DIR, 'templates')
 
+def get_config():
+    """ Alembic config of the packaged migrations """
+    global _config
+    if _config is None:
+        from alembic.config import Config as AlembicConfig
 
-CONFIG = Config(ALEMBIC_INI)
-CONFIG.set_main_option('script_location', MIGRATION_DIR)
+        class Config(AlembicConfig):
+            def get_template_directory(self):
+                return os.path.join(MIGRATION_DIR, 'templates')
+
+        _config = Config(ALEMBIC_INI)
+        _config.set_main_option('script_location', MIGRATION_DIR)
+    return _config
 
 
 def upgrade_database(revision='head', sql=False, tag=None):
     """ Upgrade to latest version (head) """
-    command.upgrade(CONFIG, revision, sql=sql, tag=tag)
+    from alembic import command
+    command.upgrade(get_config(), revision, sql=sql, tag=tag)
 
 
 def downgrade(revision='head', sql=False, tag=None):
-    command.downgrade(CONFIG, revision, sql=sql, tag=tag)
+    from alembic import command
+    command.downgrade(get_config(), revision, sql=sql, tag=tag)
 
 
 def migrate(message=None, sql=False, head='head', splice=False,
             branch_label=None, version_path=None, rev_id=None):
     """ Alias for 'revision --autogenerate' """
-    command.revision(CONFIG, message, autogenerate=True, sql=sql,
+    from alembic import command
+    command.revision(get_config(), message, autogenerate=True, sql=sql,
                      head=head, splice=splice, branch_label=branch_label,
                      version_path=version_path, rev_id=rev_id)
 
 
-def init_database(debug: bool = False):
-    # Migrate database to latest revision
-    upgrade_database()
+_REVISION = re.compile(r"^(down_)?revision\s*=\s*(.+)$", re.MULTILINE)
 
-    engine = db.create_engine(SQLALCHEMY_DATABASE_URI)
 
-    if debug:
-        # Drop all tables
-        Base.metadata.drop_all(engine)
+def head_revision() -> Optional[str]:
+    """ Read the head revision of the packaged migration scripts without importing alembic
 
-    Base.metadata.create_all(engine)
+    :returns: the revision id or None if there is not exactly one head
+    """
+    revisions, down_revisions = set(), set()
+    try:
+        scripts = list((current_dir / 'versions').glob('*.py'))
+    except OSError:
+        return None
 
-    from sqlalchemy.orm import Session
-    session = Session(engine)
+    for script in scripts:
+        try:
+            source = script.read_text(encoding='utf-8')
+        except OSError:
+            return None
 
-    if debug:
-        create_example_entry(session)
+        for down, value in _REVISION.findall(source):
+            ids = set(re.findall(r"['\"](\w+)['\"]", value))
+            (down_revisions if down else revisions).update(ids)
+
+    heads = revisions - down_revisions
+    return heads.pop() if len(heads) == 1 else None
 
-    return engine, session
 
+def _table_names(connection: sqlite3.Connection) -> Set[str]:
+    return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
 
-# Migrate database
-db_engine, db_session, = init_database()
+
+def database_at_head() -> bool:
+    """ Check with one raw sqlite3 connection that the database is at the packaged head revision
+        and contains all tables of the models
+    """
+    database_file, head = get_database_file(), head_revision()
+    if head is None or not database_file.is_file():
+        return False
+
+    try:
+        connection = sqlite3.connect(database_file.as_posix())
+        try:
+            rows = connection.execute('SELECT version_num FROM alembic_version').fetchall()
+            tables = _table_names(connection)
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        logging.debug('Could not read database revision: %s', e)
+        return False
+
+    return [r[0] for r in rows] == [head] and set(Base.metadata.tables.keys()) <= tables
+
+
+# -- Engine and sessions do not touch the database until used, call init_database before that
+db_engine = db.create_engine(SQLALCHEMY_DATABASE_URI)
 
 session_factory = sessionmaker(bind=db_engine)
 Session = scoped_session(session_factory)
 
+_schema_ready = False
+
+
+def upgrade_schema(debug: bool = False):
+    """ Migrate the database to the latest revision, skipped if it is already there """
+    global _schema_ready
+
+    if not debug and database_at_head():
+        logging.debug('Database is at head revision')
+    else:
+        # Migrate database to latest revision
+        upgrade_database()
+
+        if debug:
+            # Drop all tables
+            Base.metadata.drop_all(db_engine)
+
+        Base.metadata.create_all(db_engine)
+
+    _schema_ready = True
+
+
+def ensure_database():
+    """ Bring the database schema up to date once per process. Sessions rebound to another database
+        eg. by the benchmark manage their schema themselves.
+    """
+    if _schema_ready or Session.session_factory.kw.get('bind') is not db_engine:
+        return
+    upgrade_schema()
+
+
+def init_database(debug: bool = False):
+    """ Initialize the database schema, call once at application start
+
+    :returns: engine and a session bound to it
+    """
+    upgrade_schema(debug)
+
+    from sqlalchemy.orm import Session
+    session = Session(db_engine)
+
+    if debug:
+        create_example_entry(session)
+
+    return db_engine, session
+
 
 if __name__ == '__main__':
     upgrade_database()
@@ -1,6 +1,9 @@
+from itertools import chain
+
 import sqlalchemy as db
+from sqlalchemy import event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Session, relationship
 from sqlalchemy.orm.collections import InstrumentedList
 
 Base = declarative_base()
@@ -182,3 +185,66 @@ class Process(Base, _JsonModel):
 
     # Relationship to Profile
     profile_id = db.Column(db.Integer, db.ForeignKey('profile.id'))
+
+
+class ChangeLog(Base):
+    """ Profiles and tasks touched by database changes. The highest id is the data version of the database. """
+    __tablename__ = 'changelog'
+    # Ids are never re-used, the data version only increases
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = db.Column(db.Integer, primary_key=True)
+    profile_id = db.Column(db.Integer, index=True)
+    task_id = db.Column(db.Integer, nullable=True)
+
+
+# -- Number of changelog entries kept, older entries are removed
+CHANGELOG_SIZE = 1000
+
+
+def _touched_rows(session: Session) -> set:
+    """ (profile_id, task_id or None) of all objects of a flush """
+    touched, task_ids, process_ids = set(), set(), set()
+
+    for entry in chain(session.new, session.dirty, session.deleted):
+        if isinstance(entry, Profile):
+            touched.add((entry.id, None))
+        elif isinstance(entry, Task):
+            touched.add((entry.profile_id, entry.id))
+        elif isinstance(entry, (Condition, Gate)):
+            task_ids.add(entry.task_id)
+        elif isinstance(entry, Process):
+            if entry.profile_id is not None:
+                touched.add((entry.profile_id, None))
+            else:
+                process_ids.add(entry.id)
+
+    # -- Task and condition processes belong to the profile of their task
+    #    Queries within a flush do not autoflush
+    if process_ids:
+        task_ids.update(r[0] for r in session.query(Task.id).filter(Task.process_id.in_(process_ids)))
+        task_ids.update(r[0] for r in session.query(Condition.task_id).filter(Condition.process_id.in_(process_ids)))
+
+    task_ids.discard(None)
+    if task_ids:
+        touched.update((r[0], r[1]) for r in session.query(Task.profile_id, Task.id).filter(Task.id.in_(task_ids)))
+
+    return {(profile_id, task_id) for profile_id, task_id in touched if profile_id is not None}
+
+
+@event.listens_for(Session, 'after_flush')
+def _log_changes(session: Session, flush_context):
+    """ Record the profiles and tasks of every flush in the changelog, increasing the data version """
+    if not any(isinstance(e, (Profile, Task, Condition, Gate, Process))
+               for e in chain(session.new, session.dirty, session.deleted)):
+        return
+
+    touched = _touched_rows(session)
+    if not touched:
+        return
+
+    connection = session.connection()
+    connection.execute(ChangeLog.__table__.insert(),
+                       [{'profile_id': p, 'task_id': t} for p, t in sorted(touched, key=str)])
+    connection.execute(db.text('DELETE FROM changelog WHERE id <= (SELECT MAX(id) FROM changelog) - :size'),
+                       {'size': CHANGELOG_SIZE})
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+class ProcessTable:
+    """ Running processes by casefolded executable name maintained from process events.
+
+        The table is seeded and periodically reconciled from full enumerations of the watched processes
+        and kept current by creation and deletion events in between. It is only authoritative for the
+        process names of the last enumeration, other names report None so callers can fall back to
+        querying the system. Not thread-safe, use it from the Watchlet event loop only.
+    """
+    def __init__(self):
+        self._pids: Dict[str, Set[int]] = dict()
+
+        # -- Casefolded names the table is complete for, None means all names
+        self._known_names: Optional[Set[str]] = set()
+
+        # -- Events waiting for a change of any of their casefolded names
+        self._waiters: List[Tuple[Set[str], asyncio.Event]] = list()
+
+    def reconcile(self, process_names: Iterable[str], processes: Iterable[Tuple[str, int]]):
+        """ Replace the table contents with a full enumeration
+
+        :param process_names: casefolded names the enumeration is complete for, all names if empty
+        :param processes: (name, pid) of each running process
+        """
+        pids = dict()
+        for name, pid in processes:
+            pids.setdefault(name.casefold(), set()).add(pid)
+
+        changed = {n for n in pids.keys() | self._pids.keys() if pids.get(n) != self._pids.get(n)}
+        if changed and self._known_names:
+            logging.debug('Process table reconciled changes of %s', changed)
+
+        self._pids = pids
+        self._known_names = set(process_names) or None
+        self._notify(changed)
+
+    def apply(self, notification_type: str, name: str, pid: int):
+        """ Update the table from a process event """
+        name = name.casefold()
+
+        if notification_type == 'Deletion':
+            pids = self._pids.get(name)
+            if pids is not None:
+                pids.discard(pid)
+                if not pids:
+                    self._pids.pop(name)
+        else:
+            # Creation and Modification events both report a running process
+            self._pids.setdefault(name, set()).add(pid)
+
+        if notification_type in ('Creation', 'Deletion'):
+            self._notify({name})
+
+    def watch(self, process_names: Iterable[str]) -> asyncio.Event:
+        """ Return an event that is set once a process of these names was created or exited.
+            Call unwatch with the event when done waiting.
+        """
+        event = asyncio.Event()
+        self._waiters.append(({n.casefold() for n in process_names}, event))
+        return event
+
+    def unwatch(self, event: asyncio.Event):
+        self._waiters = [(names, e) for names, e in self._waiters if e is not event]
+
+    def _notify(self, changed_names: Set[str]):
+        if not changed_names:
+            return
+
+        for names, event in self._waiters:
+            if names & changed_names:
+                event.set()
+
+    def is_running(self, executable_name: str) -> Optional[bool]:
+        """ Report if a process with this executable name is running
+
+        :returns: None if the table does not know about this executable name
+        """
+        name = executable_name.casefold()
+        if self._known_names is not None and name not in self._known_names:
+            return None
+
+        return name in self._pids
+
+    def pids(self, executable_name: str) -> Set[int]:
+        return set(self._pids.get(executable_name.casefold(), set()))
@@ -0,0 +1,106 @@
+""" Read running processes from the Linux /proc filesystem.
+
+    Used in place of WMI Win32_Process queries on non-Windows platforms.
+"""
+import os
+from typing import Dict, NamedTuple, Optional, Tuple
+
+PROC_DIR = '/proc'
+
+
+class ProcInfo(NamedTuple):
+    pid: int
+    ppid: int
+    # Start time in clock ticks after system boot, together with the pid this identifies a process
+    start_time: int
+    name: str
+
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_stat(pid: int) -> Optional[Tuple[int, int, str]]:
+    """ Read parent pid, start time and kernel command name of a process
+
+    :returns: tuple of (ppid, start_time, comm) or None if the process vanished
+    """
+    try:
+        stat = _read(f'{PROC_DIR}/{pid}/stat').decode(errors='replace')
+    except OSError:
+        return None
+
+    # comm is enclosed in parentheses and may contain spaces or parentheses itself
+    comm_start, comm_end = stat.find('('), stat.rfind(')')
+    fields = stat[comm_end + 2:].split()
+    try:
+        # fields[0] is field 3 "state" of proc(5)
+        return int(fields[1]), int(fields[19]), stat[comm_start + 1:comm_end]
+    except (IndexError, ValueError):
+        return None
+
+
+def read_process_name(pid: int, comm: str = '') -> str:
+    """ Return the executable name of a process eg. 'rFactor2.exe'
+
+        argv[0] is preferred over the kernel comm name which is truncated to 15 characters.
+        Windows paths as reported by processes running under Wine/Proton are handled as well.
+    """
+    try:
+        cmdline = _read(f'{PROC_DIR}/{pid}/cmdline')
+    except OSError:
+        cmdline = b''
+
+    argv0 = cmdline.split(b'\0', 1)[0].decode(errors='replace')
+    name = argv0.replace('\\', '/').rsplit('/', 1)[-1]
+
+    return name or comm
+
+
+def snapshot(known: Dict[Tuple[int, int], ProcInfo] = None) -> Dict[Tuple[int, int], ProcInfo]:
+    """ Take a snapshot of all running processes keyed by (pid, start_time)
+
+    :param known: a previous snapshot, names of processes already present in it will not be read again
+    """
+    known = known or dict()
+    result = dict()
+
+    try:
+        entries = os.listdir(PROC_DIR)
+    except OSError:
+        return result
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+
+        pid = int(entry)
+        stat = read_stat(pid)
+        if stat is None:
+            continue
+
+        ppid, start_time, comm = stat
+        key = (pid, start_time)
+        if key in known:
+            result[key] = known[key]
+        else:
+            result[key] = ProcInfo(pid, ppid, start_time, read_process_name(pid, comm))
+
+    return result
+
+
+def is_alive(pid: int, start_time: Optional[int] = None) -> bool:
+    """ Check that the process identified by pid and start time has not exited, zombies count as exited.
+        Without a start time any process of this pid counts.
+    """
+    try:
+        stat = _read(f'{PROC_DIR}/{pid}/stat').decode(errors='replace')
+    except OSError:
+        return False
+
+    fields = stat[stat.rfind(')') + 2:].split()
+    try:
+        return fields[0] not in ('Z', 'X') and (start_time is None or int(fields[19]) == start_time)
+    except (IndexError, ValueError):
+        return False
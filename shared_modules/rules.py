@@ -0,0 +1,305 @@
+import logging
+import sys
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from .bitsets import ConditionBitsets
+from .stat_cache import executable_exists
+
+if TYPE_CHECKING:
+    from .models import Profile, Task
+
+
+class ProcessRule(NamedTuple):
+    executable: str
+    path: str
+    # Executable existed when the rules were compiled
+    exists: bool = False
+
+
+class ConditionRule(NamedTuple):
+    process: ProcessRule
+    running: bool
+    order: int
+
+
+class GateRule(NamedTuple):
+    order: int
+    value: bool  # True == AND; False == OR
+
+
+class ConditionExpression:
+    """ Condition and gate chain of a task compiled once per reload.
+
+        Conditions are combined strictly left to right in the order the GUI displays them, eg.
+        a OR b AND c == (a OR b) AND c. With and_precedence AND binds stronger: a OR (b AND c).
+        Missing gates default to AND. Either way the chain is compiled to terms, an OR of AND terms
+        of conditions, the single form the condition bitsets are compiled from as well. Evaluation
+        short-circuits, conditions that can not change the result are not checked at all.
+        Immutable once compiled.
+    """
+    __slots__ = ('terms',)
+
+    terms: Tuple[Tuple[ConditionRule, ...], ...]
+
+    def __init__(self, conditions: Sequence[ConditionRule], gates: Sequence[GateRule], and_precedence: bool = False):
+        gate_values = [g.value is not False for g in sorted(gates, key=lambda g: g.order)]
+        gate_values += [True] * (len(conditions) - 1 - len(gate_values))
+
+        terms: List[Tuple[ConditionRule, ...]] = [tuple()]
+        for idx, condition in enumerate(conditions):
+            if idx and not gate_values[idx - 1]:
+                # OR: the condition starts a term of its own (a AND b) OR c
+                terms.append((condition,))
+            elif and_precedence:
+                # AND binds to the last term only: a OR (b AND c)
+                terms[-1] += (condition,)
+            else:
+                # Left to right an AND applies to everything before: (a OR b) AND c
+                terms = [term + (condition,) for term in terms]
+
+        object.__setattr__(self, 'terms', tuple(terms))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def evaluate(self, is_met: Callable[[ConditionRule], bool]) -> bool:
+        """ Evaluate the expression
+
+        :param is_met: check of a single condition, only called for conditions the result depends on
+                       and once per condition
+        :returns: True if the conditions are met. Also True if no conditions present.
+        """
+        results: Dict[ConditionRule, bool] = dict()
+
+        def met(condition: ConditionRule) -> bool:
+            if condition not in results:
+                results[condition] = is_met(condition)
+            return results[condition]
+
+        return any(all(met(c) for c in term) for term in self.terms)
+
+
+class TaskRule(NamedTuple):
+    """ Read-only copy of a Task with everything needed to check and execute it """
+    id: int
+    profile_id: int
+    name: str
+    active: bool
+    stop: bool
+    allow_multiple_instances: bool
+    cwd: str
+    command: str
+    wnd_minimized: bool
+    wnd_active: bool
+    process: ProcessRule
+    # Sorted by condition order
+    conditions: Tuple[ConditionRule, ...]
+    # Sorted by gate order
+    gates: Tuple[GateRule, ...]
+    expression: ConditionExpression
+
+    @classmethod
+    def from_task(cls, task: 'Task', and_precedence: bool = False) -> 'TaskRule':
+        conditions = tuple(ConditionRule(_process_rule(c.process), bool(c.running), c.order)
+                           for c in sorted(task.conditions, key=lambda c: c.order))
+        gates = tuple(GateRule(g.order, g.value) for g in sorted(task.gates, key=lambda g: g.order))
+        return cls(task.id, task.profile_id, task.name, bool(task.active), bool(task.stop),
+                   bool(task.allow_multiple_instances), task.cwd, task.command, bool(task.wnd_minimized),
+                   bool(task.wnd_active), _process_rule(task.process), conditions, gates,
+                   ConditionExpression(conditions, gates, and_precedence))
+
+    def refreshed(self, and_precedence: bool = False) -> 'TaskRule':
+        """ Check the executables of the task and condition processes again, returns self if none changed """
+        process = _refreshed_process(self.process)
+        conditions = tuple(c._replace(process=_refreshed_process(c.process)) for c in self.conditions)
+        if process == self.process and conditions == self.conditions:
+            return self
+        return self._replace(process=process, conditions=conditions,
+                             expression=ConditionExpression(conditions, self.gates, and_precedence))
+
+
+class ProfileRule(NamedTuple):
+    id: int
+    name: str
+    # Casefolded executable names of all profile processes
+    triggers: FrozenSet[str]
+    tasks: Tuple[TaskRule, ...]
+    # (casefolded executable name, notification type) of profile processes whose executable exists
+    routes: FrozenSet[Tuple[str, str]] = frozenset()
+    # Executable names of the routed profile processes
+    process_names: FrozenSet[str] = frozenset()
+    # Executable names of task and condition processes whose running state we need to know
+    tracked_names: FrozenSet[str] = frozenset()
+    # (process, notification type) of all profile processes
+    processes: Tuple[Tuple[ProcessRule, str], ...] = tuple()
+
+    @classmethod
+    def from_profile(cls, profile: 'Profile', and_precedence: bool = False) -> 'ProfileRule':
+        """ Compile a profile. Profile processes whose executable does not exist are not routed. """
+        logging.info('Profile: %s - %s', profile.id, profile.name)
+        processes = tuple((_process_rule(p), p.notification_type) for p in profile.processes)
+        tasks = tuple(TaskRule.from_task(task, and_precedence) for task in profile.tasks)
+
+        tracked_names = set()
+        for task in tasks:
+            tracked_processes = [task.process] + [c.process for c in task.conditions]
+            tracked_names.update(p.executable for p in tracked_processes if p.executable)
+
+        triggers = frozenset(p.executable.casefold() for p, _ in processes if p.executable)
+        return cls(profile.id, profile.name, triggers, tasks, *_routes(processes), frozenset(tracked_names),
+                   processes)
+
+    def refreshed(self, and_precedence: bool = False) -> 'ProfileRule':
+        """ Check all executables of the profile again, eg. after the stat cache was invalidated.
+            Returns self if none was installed or removed.
+        """
+        processes = tuple((_refreshed_process(p), notification_type) for p, notification_type in self.processes)
+        tasks = tuple(task.refreshed(and_precedence) for task in self.tasks)
+        if processes == self.processes and all(a is b for a, b in zip(tasks, self.tasks)):
+            return self
+        routes, process_names = _routes(processes)
+        return self._replace(tasks=tasks, routes=routes, process_names=process_names, processes=processes)
+
+
+def _routes(processes: Iterable[Tuple[ProcessRule, str]]) -> Tuple[FrozenSet[Tuple[str, str]], FrozenSet[str]]:
+    """ Routes and executable names of the profile processes, skipping non existing executables """
+    routes, process_names = set(), set()
+    for process, notification_type in processes:
+        if not process.exists:
+            continue
+
+        routes.add((process.executable.casefold(), notification_type))
+        process_names.add(process.executable)
+    return frozenset(routes), frozenset(process_names)
+
+
+def _process_rule(process) -> ProcessRule:
+    if process is None:
+        return ProcessRule('', '')
+    # Many tasks share the same executables, keep one copy of each name
+    executable, path = sys.intern(process.executable or ''), sys.intern(process.path or '')
+    return ProcessRule(executable, path, executable_exists(path, executable))
+
+
+def _refreshed_process(process: ProcessRule) -> ProcessRule:
+    exists = executable_exists(process.path, process.executable)
+    return process if exists == process.exists else process._replace(exists=exists)
+
+
+class RuleIndex:
+    """ Profiles of the database compiled into lookups by executable name and notification type.
+
+        Built once per reload and not changed afterwards. The index is a snapshot of immutable rules
+        detached from the database, it holds no ORM objects or sessions and may be shared between
+        threads. Matching a process event is a dictionary lookup. Executable existence is checked
+        once while compiling, evaluations do no filesystem access. The data version of the database
+        the index was compiled from allows to update only the profiles changed since.
+    """
+    __slots__ = ('_profiles', '_routes', '_and_precedence', 'data_version', 'bitsets', '_by_name',
+                 'process_names', 'tracked_names', 'notification_types')
+
+    # -- Compile condition gates with AND binding stronger than OR instead of strictly left to right
+    and_precedence = False
+
+    def __init__(self, profiles: Iterable[ProfileRule], and_precedence: bool = False, data_version: int = 0):
+        self._profiles: Dict[int, ProfileRule] = {p.id: p for p in profiles}
+        self._and_precedence = and_precedence
+        self.data_version = data_version
+
+        # -- Profile ids by routed (casefolded executable name, notification type)
+        routes: Dict[Tuple[str, str], Set[int]] = dict()
+        for profile in self._profiles.values():
+            for route in profile.routes:
+                routes.setdefault(route, set()).add(profile.id)
+        self._routes: Dict[Tuple[str, str], FrozenSet[int]] = {k: frozenset(v) for k, v in routes.items()}
+
+        # -- Conditions of all tasks compiled for batch evaluation
+        self.bitsets = ConditionBitsets(t for p in self._profiles.values() for t in p.tasks)
+
+        # -- Profile ids by casefolded trigger name of any notification type
+        by_name: Dict[str, Set[int]] = dict()
+        for profile in self._profiles.values():
+            for name in profile.triggers:
+                by_name.setdefault(name, set()).add(profile.id)
+        self._by_name: Dict[str, Tuple[int, ...]] = {n: tuple(sorted(ids)) for n, ids in by_name.items()}
+
+        # -- Executable names of routed profile processes
+        self.process_names: FrozenSet[str] = frozenset(n for p in self._profiles.values() for n in p.process_names)
+        # -- Executable names of task and condition processes whose running state we need to know
+        self.tracked_names: FrozenSet[str] = frozenset(n for p in self._profiles.values() for n in p.tracked_names)
+        self.notification_types: FrozenSet[str] = frozenset(t for _, t in self._routes.keys())
+
+    @classmethod
+    def from_profiles(cls, profiles: Iterable['Profile'], and_precedence: bool = None,
+                      data_version: int = 0) -> 'RuleIndex':
+        """ Compile active profiles. Profile processes whose executable does not exist are not routed.
+
+        :param profiles: profiles to compile
+        :param and_precedence: evaluate AND gates before OR gates, defaults to RuleIndex.and_precedence
+        :param data_version: data version of the database the profiles were read from
+        """
+        and_precedence = cls.and_precedence if and_precedence is None else and_precedence
+        return cls([ProfileRule.from_profile(p, and_precedence) for p in profiles if p.active], and_precedence,
+                   data_version)
+
+    def updated(self, profiles: Iterable['Profile'], profile_ids: Iterable[int], data_version: int) -> 'RuleIndex':
+        """ Return a new index with the rules of changed profiles compiled again, other profiles are kept
+
+        :param profiles: current state of the changed profiles, deleted profiles are missing
+        :param profile_ids: ids of all changed profiles
+        :param data_version: data version of the database the profiles were read from
+        """
+        profile_ids = set(profile_ids)
+        # -- Executables of unchanged profiles may have been installed or removed meanwhile
+        rules = [p.refreshed(self._and_precedence) for p in self._profiles.values() if p.id not in profile_ids]
+        rules += [ProfileRule.from_profile(p, self._and_precedence) for p in profiles
+                  if p.active and p.id in profile_ids]
+
+        logging.info('Updated the rules of %s changed profiles', len(profile_ids))
+        return RuleIndex(rules, self._and_precedence, data_version)
+
+    def __bool__(self):
+        """ True if there is anything to watch """
+        return bool(self._routes)
+
+    @property
+    def routes(self) -> FrozenSet[Tuple[str, str]]:
+        """ (casefolded executable name, notification type) of all routes """
+        return frozenset(self._routes.keys())
+
+    def route(self, process_name: str, notification_type: str) -> FrozenSet[int]:
+        """ Return the ids of the profiles watching for this event """
+        process_name = process_name.casefold()
+        return self._routes.get((process_name, notification_type), frozenset()) | \
+            self._routes.get((process_name, 'Operation'), frozenset())
+
+    @property
+    def profile_ids(self) -> Tuple[int, ...]:
+        return tuple(sorted(self._profiles.keys()))
+
+    def profile(self, profile_id: int) -> Optional[ProfileRule]:
+        return self._profiles.get(profile_id)
+
+    def match(self, process_name: str, profile_ids: Iterable[int] = None) -> List[TaskRule]:
+        """ Collect the tasks of all profiles this executable has 'hit'
+
+        :param process_name: executable name of the process
+        :param profile_ids: only look at these profiles, all profiles if None
+        """
+        process_name = process_name.casefold()
+        if profile_ids is None:
+            profile_ids = self._by_name.get(process_name, tuple())
+
+        tasks = list()
+        for profile_id in profile_ids:
+            profile = self._profiles.get(profile_id)
+            if profile is None or process_name not in profile.triggers:
+                continue
+
+            logging.debug('Process %s matched profile %s', process_name, profile.name)
+            tasks += profile.tasks
+
+        return tasks
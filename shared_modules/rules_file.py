@@ -0,0 +1,126 @@
+""" Compiled rules file exported by the GUI and read by the watcher.
+
+    The file holds the active profiles with everything the watcher needs to compile its RuleIndex as
+    canonical JSON: sorted keys, no whitespace and entries sorted by id or order, so equal databases
+    export byte-identical files. Reading it needs neither SQLAlchemy nor alembic. The watcher falls
+    back to the database if the file is missing, of another format version or older than the database.
+    The data version of the database is stored with the profiles, so a reader holding older rules only
+    compiles the profiles the changelog reports as changed.
+"""
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from .changelog import read_changed_profiles
+from .globals import get_database_file, get_rules_file
+from .rules import RuleIndex
+
+if TYPE_CHECKING:
+    from .models import Process, Profile, Task
+
+# -- Increase on any change of the file layout, readers ignore files of other versions
+RULES_FORMAT_VERSION = 1
+
+
+def _process_data(process: Optional['Process']) -> Optional[dict]:
+    if process is None:
+        return None
+    return {'executable': process.executable or '', 'path': process.path or '',
+            'notification_type': process.notification_type}
+
+
+def _task_data(task: 'Task') -> dict:
+    return {'id': task.id, 'profile_id': task.profile_id, 'name': task.name, 'active': bool(task.active),
+            'stop': bool(task.stop), 'allow_multiple_instances': bool(task.allow_multiple_instances),
+            'cwd': task.cwd or '', 'command': task.command or '', 'wnd_minimized': bool(task.wnd_minimized),
+            'wnd_active': bool(task.wnd_active), 'process': _process_data(task.process),
+            'conditions': [{'process': _process_data(c.process), 'running': bool(c.running), 'order': c.order}
+                           for c in sorted(task.conditions, key=lambda c: (c.order, c.id))],
+            'gates': [{'order': g.order, 'value': g.value} for g in sorted(task.gates, key=lambda g: (g.order, g.id))]}
+
+
+def profiles_data(profiles: Iterable['Profile'], data_version: int = 0) -> dict:
+    """ Plain data of the active profiles as written to the rules file """
+    return {'format': RULES_FORMAT_VERSION, 'data_version': data_version,
+            'profiles': [{'id': p.id, 'name': p.name, 'active': True,
+                          'processes': [_process_data(process) for process in sorted(p.processes, key=lambda x: x.id)],
+                          'tasks': [_task_data(t) for t in sorted(p.tasks, key=lambda t: t.id)]}
+                         for p in sorted(profiles, key=lambda p: p.id) if p.active]}
+
+
+def write_rules_file(profiles: Iterable['Profile'], data_version: int = 0, file: Path = None) -> Path:
+    """ Export the rules of the active profiles, replacing the previous file atomically
+
+    :param profiles: profiles loaded with their tasks, eg. by utils.load_profiles
+    :param data_version: data version of the database the profiles were read from
+    :param file: defaults to the rules file in the settings directory
+    """
+    file = file or get_rules_file()
+    content = json.dumps(profiles_data(profiles, data_version), sort_keys=True, separators=(',', ':'),
+                         ensure_ascii=False)
+
+    tmp_file = file.with_name(f'{file.name}.tmp')
+    with open(tmp_file.as_posix(), 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_file.as_posix(), file.as_posix())
+
+    logging.debug('Exported rules file %s with %s bytes', file.name, len(content))
+    return file
+
+
+def _namespace(data):
+    """ Turn the JSON data into objects with the attributes RuleIndex.from_profiles reads from models """
+    if isinstance(data, dict):
+        return SimpleNamespace(**{k: _namespace(v) for k, v in data.items()})
+    if isinstance(data, list):
+        return [_namespace(v) for v in data]
+    return data
+
+
+def read_rules_file(file: Path = None, database_file: Path = None, current: RuleIndex = None) \
+        -> Optional[RuleIndex]:
+    """ Compile the rules of an exported rules file
+
+    :param file: defaults to the rules file in the settings directory
+    :param database_file: the file is only used if it is not older than this database
+    :param current: rules compiled before, only profiles changed since its data version are compiled again.
+                    Returned as is if nothing changed.
+    :returns: the compiled rules or None if the database needs to be read instead
+    """
+    file, database_file = file or get_rules_file(), database_file or get_database_file()
+    start = time.perf_counter()
+
+    try:
+        if database_file.exists() and database_file.stat().st_mtime > file.stat().st_mtime:
+            logging.info('Rules file %s is older than the database', file.name)
+            return None
+
+        with open(file.as_posix(), 'rb') as f:
+            data = json.loads(f.read())
+    except FileNotFoundError:
+        logging.debug('No rules file found at %s', file.as_posix())
+        return None
+    except (OSError, ValueError) as e:
+        logging.error('Could not read rules file %s: %s', file.as_posix(), e)
+        return None
+
+    if not isinstance(data, dict) or data.get('format') != RULES_FORMAT_VERSION:
+        logging.info('Rules file %s has an unsupported format, reading the database', file.name)
+        return None
+
+    version, profiles = data.get('data_version', 0), data.get('profiles', list())
+
+    changed = read_changed_profiles(current.data_version, version, database_file) if current is not None else None
+    if changed is not None:
+        if not changed:
+            return current
+        return current.updated(_namespace([p for p in profiles if p.get('id') in changed]), changed, version)
+
+    rules = RuleIndex.from_profiles(_namespace(profiles), data_version=version)
+    logging.info('Read rules file with %s profiles in %.1f ms', len(rules.profile_ids),
+                 (time.perf_counter() - start) * 1000)
+    return rules
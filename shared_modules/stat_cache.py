@@ -0,0 +1,87 @@
+import logging
+import os
+import stat
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+
+class StatCache:
+    """ Remember whether executables exist so repeated checks of the same path do not hit slow or network drives.
+
+        Entries are keyed by normalized path and refreshed once they are older than ttl_secs.
+        Invalidate the cache on reload to pick up changes at once. Thread-safe.
+    """
+    # -- Seconds a stat result is reused
+    ttl_secs = 30.0
+
+    # -- Report every path as an existing file without looking, eg. to replay traces recorded on another machine
+    assume_existing = False
+
+    def __init__(self, ttl_secs: float = None):
+        if ttl_secs is not None:
+            self.ttl_secs = ttl_secs
+
+        # -- Normalized path -> (st_mode or None if the path does not exist, time of the stat)
+        self._entries: Dict[str, Tuple[Optional[int], float]] = dict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(path: Union[Path, str]) -> str:
+        return os.path.normcase(os.path.normpath(os.fspath(path)))
+
+    def _mode(self, path: Union[Path, str]) -> Optional[int]:
+        if self.assume_existing:
+            return stat.S_IFREG
+
+        key, now = self.normalize(path), time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] <= self.ttl_secs:
+                self.hits += 1
+                return entry[0]
+
+        # Stat outside the lock, a slow drive should not block other lookups
+        try:
+            mode = os.stat(key).st_mode
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logging.debug('Can not access path: %s', e)
+            mode = None
+
+        with self._lock:
+            self._entries[key] = (mode, now)
+            self.misses += 1
+
+        return mode
+
+    def exists(self, path: Union[Path, str]) -> bool:
+        return self._mode(path) is not None
+
+    def is_file(self, path: Union[Path, str]) -> bool:
+        mode = self._mode(path)
+        return mode is not None and stat.S_ISREG(mode)
+
+    def invalidate(self, path: Union[Path, str] = None):
+        """ Forget a single path or all paths if None """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self.normalize(path), None)
+
+
+# -- Cache of the watcher's rule compilation, user driven checks eg. in the GUI stat the path directly
+stat_cache = StatCache()
+
+
+def executable_exists(path: str, executable: str) -> bool:
+    """ Check that an executable in a directory exists, an empty executable name never exists """
+    if not executable:
+        return False
+    return stat_cache.exists(Path(path or '') / executable)
@@ -2,67 +2,312 @@ import asyncio
 import logging
 import shlex
 import subprocess
+import sys
 import time
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, Callable, FrozenSet, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
 
-import win32con
-import wmi
+from .launcher import LaunchResult, LaunchTracker, TaskLauncher
+from .process_table import ProcessTable
+from .rules import ConditionRule, RuleIndex, TaskRule
+from .terminator import ProcessTerminator, running_process_names
 
-from .models import Task
-from .utils import CheckConditionsGated, is_process_running, iterate_profiles, match_profiles
-from .migrate import Session
+# -- The database modules are imported on first use, the watcher running on an exported rules file
+#    does not load SQLAlchemy and alembic at all
+if TYPE_CHECKING:
+    from .models import Task
+
+
+class TaskVerdict(NamedTuple):
+    """ Result of a what-if evaluation of a single task """
+    profile_id: int
+    task_id: int
+    task_name: str
+    # 'start', 'stop' or empty if the task would not be executed
+    action: str
+    reason: str
+    # (executable, required to run, running, met) of each condition
+    conditions: Tuple[Tuple[str, bool, bool, bool], ...] = ()
 
 
 class TaskManager:
     debug_conditions = False
 
+    # -- Table of running processes maintained by the watcher,
+    #    condition checks query the system directly for names the table does not know
+    process_table: Optional[ProcessTable] = None
+
+    # -- Starts and stops task processes off the event loop,
+    #    set launcher.ordered to launch the tasks of an evaluation one after another
+    launcher = TaskLauncher()
+
+    # -- Launch state of tasks preventing redundant launches
+    launch_tracker = LaunchTracker()
+
+    # -- Stops the processes of stop tasks, closing them gracefully before they are terminated
+    terminator = ProcessTerminator()
+
+    # -- Receives activated tasks instead of executing them, eg. the fake launcher of the replay harness
+    execute_hook: Optional[Callable[[List[Union['Task', TaskRule]]], None]] = None
+
+    # -- Seconds unmet tasks of an evaluation are checked again on changes of their processes
+    retry_deadline_secs = 10.0
+
+    # -- Seconds an enumeration of all running processes is reused by following evaluations
+    snapshot_ttl_secs = 1.0
+    _snapshot: Optional[FrozenSet[str]] = None
+    _snapshot_time = 0.0
+
     @classmethod
-    async def find_tasks(cls, p_name: str, pid: str) -> bool:
-        """ Find all tasks activated by the created process """
-        logging.info('Found %s, %s', p_name, pid)
+    def running_snapshot(cls) -> FrozenSet[str]:
+        """ Casefolded names of all running processes, enumerated at most once per snapshot_ttl_secs """
+        now = time.monotonic()
+        if cls._snapshot is None or now - cls._snapshot_time > cls.snapshot_ttl_secs:
+            cls._snapshot, cls._snapshot_time = frozenset(running_process_names()), now
+
+        return cls._snapshot
+
+    @classmethod
+    def process_lookup(cls) -> Callable[[str], bool]:
+        """ Return a running check for one evaluation. Names unknown to the process table are looked up
+            in a single enumeration of all processes shared by every check of the evaluation.
+        """
+        table, snapshot = cls.process_table, None
 
-        # - Create local session
-        Session()
+        def is_running(executable_name: str) -> bool:
+            nonlocal snapshot
+            if table is not None:
+                running = table.is_running(executable_name)
+                if running is not None:
+                    return running
 
-        # -- Find profiles this executable has 'hit'
-        active_profiles = match_profiles(list(iterate_profiles(Session)), p_name)
+            if snapshot is None:
+                snapshot = cls.running_snapshot()
+            return executable_name.casefold() in snapshot
 
-        # -- Collect tasks of active profiles
-        tasks = list()
-        for profile in active_profiles:
-            tasks += profile.tasks
+        return is_running
 
-        # -- Find tasks whose conditions are met
-        num_tries, activated_tasks, log_level = 2, list(), logging.DEBUG
-        while (num_tries := num_tries - 1) >= 0 and not activated_tasks:
-            for task in tasks:
-                logging.debug('Run #%s Checking task: %s', 2-num_tries, task.name)
+    @staticmethod
+    def load_rules(current: RuleIndex = None) -> RuleIndex:
+        """ Compile the rules of all profiles in the database
+
+        :param current: rules compiled before, only profiles changed since its data version are compiled again.
+                        Returned as is if nothing changed.
+        """
+        from .changelog import changed_profiles, data_version, session_execute
+        from .migrate import Session, ensure_database
+        from .utils import load_profiles
+
+        ensure_database()
+
+        # - Create a session private to this call, calls run concurrently within the same thread
+        session = Session.session_factory()
+        try:
+            execute = session_execute(session)
+            version = data_version(execute)
+
+            changed = changed_profiles(execute, current.data_version, version) if current is not None else None
+            if changed is not None:
+                if not changed:
+                    return current
+                return current.updated(load_profiles(session, active_only=False, profile_ids=changed), changed,
+                                       version)
 
-                if cls._check_task_conditions(task):
-                    activated_tasks.append(task)
+            return RuleIndex.from_profiles(load_profiles(session), data_version=version)
+        finally:
+            session.close()
+
+    @classmethod
+    async def find_tasks(cls, p_name: str, pid: str, profile_ids: Iterable[int] = None,
+                         rules: RuleIndex = None, slot: asyncio.Semaphore = None) -> bool:
+        """ Find all tasks activated by the created process. Activated tasks are executed at once,
+            tasks whose conditions are not met are checked again on changes of their processes
+            until retry_deadline_secs passed.
+
+        :param p_name: executable name of the process
+        :param pid: process id
+        :param profile_ids: only look at these profiles, all profiles if None
+        :param rules: compiled rules to match against, read from the database if None
+        :param slot: held while checking and executing tasks but not while waiting for a retry
+        """
+        logging.info('Found %s, %s', p_name, pid)
+
+        if rules is None:
+            rules = cls.load_rules()
+
+        # -- Collect tasks of the profiles this executable has 'hit'
+        pending = [task for task in rules.match(p_name, profile_ids) if task.active]
+        activated_tasks, run = list(), 0
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + cls.retry_deadline_secs
+
+        while pending:
+            # -- Find tasks whose conditions are met, one process lookup per run shared by all tasks
+            run += 1
+            if slot is not None:
+                await slot.acquire()
+            try:
+                logging.debug('Run #%s Checking tasks: %s', run, ', '.join(task.name for task in pending))
+                results = cls.check_tasks(pending, rules, cls.process_lookup())
+                activated = [task for task, met in zip(pending, results) if met]
+
+                if activated:
+                    await cls._execute_tasks(activated)
+                    activated_tasks += activated
+                    pending = [task for task in pending if task not in activated]
+            finally:
+                if slot is not None:
+                    slot.release()
 
             # - Sometimes exiting processes take a while to be recognized as "not running"
-            #   try two times if we did not found a activated task before
-            await asyncio.sleep(10)
+            #   check again once a process of the remaining tasks changed or a last time at the deadline
+            remaining = deadline - loop.time()
+            if not pending or remaining <= 0:
+                break
 
-        cls._execute_tasks(activated_tasks)
+            await cls._wait_for_change(cls._task_process_names(pending), remaining)
 
-        # - Remove local session
-        Session.remove()
         return True if activated_tasks else False
 
     @classmethod
-    def _execute_tasks(cls, tasks: List[Task]):
+    def evaluate(cls, profile_ids: Iterable[int] = None, running: Iterable[str] = (),
+                 event: Tuple[str, str] = None, rules: RuleIndex = None, explain: bool = True) -> List[TaskVerdict]:
+        """ Evaluate which tasks would be started or stopped for a hypothetical set of running processes.
+            Uses the same compiled rules as the watcher but does not look at the system, launch or wait.
+
+        :param profile_ids: only look at these profiles, all profiles if None
+        :param running: executable names of the running processes
+        :param event: (executable name, notification type) of the triggering event. Evaluate all tasks
+                      of the profiles if None.
+        :param rules: compiled rules to evaluate, read from the database if None
+        :param explain: report the state of every condition of every task
+        """
+        if rules is None:
+            rules = cls.load_rules()
+
+        running = {n.casefold() for n in running}
+        if event is not None:
+            name, notification_type = event
+
+            # - The event changes the running processes like it would change the watcher's process table
+            if notification_type == 'Deletion':
+                running.discard(name.casefold())
+            elif notification_type in ('Creation', 'Modification'):
+                running.add(name.casefold())
+
+            hit_ids = rules.route(name, notification_type)
+            if profile_ids is not None:
+                hit_ids = hit_ids & set(profile_ids)
+            tasks = rules.match(name, sorted(hit_ids))
+        else:
+            profiles = [rules.profile(i) for i in (rules.profile_ids if profile_ids is None else profile_ids)]
+            tasks = [task for profile in profiles if profile is not None for task in profile.tasks]
+
+        def is_running(executable_name: str) -> bool:
+            return executable_name.casefold() in running
+
+        verdicts = list()
+        for task, met in zip(tasks, cls.check_tasks(tasks, rules, is_running)):
+            reason = cls._task_not_ready(task, is_running) or ('conditions met' if met else 'conditions not met')
+            conditions = cls._explain_conditions(task, is_running) if explain else ()
+            action = ('stop' if task.stop else 'start') if met else ''
+            verdicts.append(TaskVerdict(task.profile_id, task.id, task.name, action, reason, conditions))
+
+        return verdicts
+
+    @staticmethod
+    def _explain_conditions(task: TaskRule, is_running: Callable[[str], bool]) \
+            -> Tuple[Tuple[str, bool, bool, bool], ...]:
+        explained = list()
+        for condition in task.conditions:
+            process_running = condition.process.exists and is_running(condition.process.executable)
+            explained.append((condition.process.executable, condition.running, process_running,
+                              condition.running == process_running))
+        return tuple(explained)
+
+    @staticmethod
+    def _task_process_names(tasks: List[TaskRule]) -> Set[str]:
+        names = set()
         for task in tasks:
-            if task.stop:
-                cls.stop_task(task)
+            names.add(task.process.executable)
+            names.update(c.process.executable for c in task.conditions)
+        return {n for n in names if n}
+
+    @classmethod
+    async def _wait_for_change(cls, process_names: Set[str], timeout: float) -> bool:
+        """ Wait until a process of these names was created or exited
+
+        :returns: False if timeout passed without a change
+        """
+        table = cls.process_table
+        if table is None:
+            # - Without a process table there is nothing to be notified by
+            await asyncio.sleep(timeout)
+            return False
+
+        changed = table.watch(process_names)
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            table.unwatch(changed)
+
+    @classmethod
+    async def _execute_tasks(cls, tasks: List[Union['Task', TaskRule]]) -> List[LaunchResult]:
+        # -- Skip tasks that are being launched, still running from our launch or cooling down
+        claimed = list()
+        for task in tasks:
+            reason = cls.launch_tracker.claim(task)
+            if reason:
+                logging.info('Skipping task %s: %s', task.name, reason)
+            else:
+                claimed.append(task)
+
+        try:
+            if cls.execute_hook is not None:
+                cls.execute_hook(claimed)
+                results = None
             else:
-                cls.start_task(task)
+                results = await cls.launcher.launch(claimed, cls.execute_task, cls.execute_stop_tasks)
+        except BaseException:
+            # - Cancelled or failed, we do not know the outcome of the launches. Release the claims,
+            #   the cooldown still applies.
+            for task in claimed:
+                cls.launch_tracker.finish(task, False)
+            raise
+
+        if results is None:
+            for task in claimed:
+                cls.launch_tracker.finish(task, True)
+            return list()
+
+        for task, r in zip(claimed, results):
+            cls.launch_tracker.finish(task, r.success, r.pid)
+            logging.info('Task %s %s %s in %.3fs%s', r.task_name, 'stop' if r.stop else 'start',
+                         'succeeded' if r.success else 'failed', r.duration, f': {r.error}' if r.error else '')
+        return results
+
+    @classmethod
+    def execute_task(cls, task: Union['Task', TaskRule]) -> Tuple[bool, int]:
+        """ Start or stop the task process, blocking
+
+        :returns: success and the pid of a started process
+        """
+        if task.stop:
+            return cls.stop_task(task), 0
+
+        pid = cls.start_task(task)
+        return pid is not None, pid or 0
 
     @staticmethod
-    def start_task(task: Task):
-        """ Task should start a process """
+    def start_task(task: Union['Task', TaskRule]) -> Optional[int]:
+        """ Task should start a process
+
+        :returns: pid of the started process or None if it could not be started
+        """
         executable = Path(task.process.path) / task.process.executable
         command = [str(executable.resolve())]
 
@@ -81,7 +326,24 @@ class TaskManager:
         logging.info(f'Executing task: {task.name} with command: {command}. Window will be '
                      f'opened {min[task.wnd_minimized]} and set to {act[task.wnd_active]}.')
 
-        # -- Window Creation Flags
+        # -- Start process
+        #    and add current working directory
+        try:
+            process = subprocess.Popen(command, cwd=task.cwd or None, startupinfo=TaskManager._startup_info(task))
+        except OSError as e:
+            logging.error('Could not start executable. Probably higher privileges are required. %s', e)
+            return
+
+        return process.pid
+
+    @staticmethod
+    def _startup_info(task: Union['Task', TaskRule]) -> Optional['subprocess.STARTUPINFO']:
+        """ Window creation flags of the task process, None on platforms without them """
+        if sys.platform != 'win32':
+            return None
+
+        import win32con
+
         info = subprocess.STARTUPINFO()
         info.dwFlags |= subprocess.STARTF_USESHOWWINDOW
 
@@ -99,87 +361,111 @@ class TaskManager:
             info.dwFlags = ~subprocess.STARTF_USESHOWWINDOW
             # info.wShowWindow = win32con.SW_SHOWDEFAULT
 
-        # -- Start process
-        #    and add current working directory
         logging.debug('Window ShowWindow Flag: %s', info.wShowWindow)
-        try:
-            subprocess.Popen(command, cwd=task.cwd or None, startupinfo=info)
-        except OSError as e:
-            logging.error('Could not start executable. Probably higher privileges are required. %s', e)
+        return info
 
-        time.sleep(0.1)
+    @classmethod
+    def execute_stop_tasks(cls, tasks: List[Union['Task', TaskRule]]) -> List[Tuple[bool, int]]:
+        """ Stop tasks together, blocking """
+        return [(success, 0) for success in cls.stop_tasks(tasks)]
 
-    @staticmethod
-    def stop_task(task: Task) -> bool:
+    @classmethod
+    def stop_task(cls, task: Union['Task', TaskRule], graceful: bool = True) -> bool:
         """ Task should stop a process """
-        c = wmi.WMI(find_classes=False)
-        r = c.Win32_Process(Name=task.process.executable)
-        if r:
-            for p in r:
-                result = p.Terminate()
-
-                if len(result) >= 1 and result[0] != 0:
-                    logging.error('Task %s could not terminate process: %s', task.name, task.process.executable)
-                    logging.error('Termination result: %s', result)
-                    return False
-
-                logging.debug('Task %s terminated process: %s', task.name, task.process.executable)
-        else:
-            logging.debug('Task %s could not find process: %s to terminate', task.name, task.process.executable)
-            return False
+        return cls.stop_tasks([task], graceful)[0]
 
-        return True
+    @classmethod
+    def stop_tasks(cls, tasks: List[Union['Task', TaskRule]], graceful: bool = True) -> List[bool]:
+        """ Stop the processes of several stop tasks at once, they share one timeout window
 
-    @staticmethod
-    def _check_task_conditions(task: Task) -> bool:
-        """ Check if all conditions for a task are met
+        :param graceful: request the processes to close before terminating them, this blocks for up to
+                         ProcessTerminator.close_timeout_secs
+        :returns: for each task True if all processes of its executable exited
+        """
+        results = dict()
+        for r in cls.terminator.stop((task.process.executable for task in tasks), graceful):
+            results.setdefault(r.executable.casefold(), list()).append(r)
 
-        :param Task task: the task whose conditions should be tested
-        :returns: True if all conditions where met. Also True if no conditions present.
+        stopped = list()
+        for task in tasks:
+            task_results = results.get((task.process.executable or '').casefold(), list())
+            if not task_results:
+                logging.debug('Task %s could not find process: %s to terminate', task.name, task.process.executable)
+
+            for r in task_results:
+                if r.success:
+                    logging.debug('Task %s %s process: %s #%s in %.2fs', task.name, r.outcome, r.executable, r.pid,
+                                  r.duration)
+                else:
+                    logging.error('Task %s could not terminate process: %s #%s: %s', task.name, r.executable, r.pid,
+                                  r.error)
+
+            stopped.append(bool(task_results) and all(r.success for r in task_results))
+        return stopped
+
+    @classmethod
+    def check_tasks(cls, tasks: List[TaskRule], rules: RuleIndex, is_running: Callable[[str], bool]) -> List[bool]:
+        """ Check the conditions of all tasks in one pass over the compiled condition bitsets
+
+        :returns: for each task True if it is ready and its conditions are met
         """
-        if not task.active:
-            logging.debug('Task %s is set in-active.', task.name)
-            return False
+        if cls.debug_conditions:
+            # - Check one condition after the other to log each result
+            return [cls._check_task_conditions(task, is_running) for task in tasks]
 
-        results = list()
-        d = {False: 'is not running', True: 'is running'}
+        ready = [task for task in tasks if cls._check_task_ready(task, is_running)]
+        met = {task.id for task, result in zip(ready, rules.bitsets.evaluate(ready, is_running)) if result}
+        return [task.id in met for task in tasks]
+
+    @staticmethod
+    def _task_not_ready(task: TaskRule, is_running: Callable[[str], bool]) -> str:
+        """ Return why the task can not be executed regardless of its conditions, empty if it is ready """
+        if not task.active:
+            return 'task is set in-active'
 
         # -- Check that task executable exists
-        task_executable_path = Path(task.process.path) / task.process.executable
-        if not task_executable_path.exists() or not task.process.executable:
-            return False
+        if not task.process.exists:
+            return 'task executable does not exist'
 
         # -- Check that task executable is not already running/not running
-        if not task.stop and not task.allow_multiple_instances and is_process_running(task.process.executable):
-            logging.debug('Task %s executable already running.', task.name)
-            return False
-        elif task.stop and not is_process_running(task.process.executable):
-            logging.debug('Task %s executable already stopped.', task.name)
-            return False
+        if not task.stop and not task.allow_multiple_instances and \
+                is_running(task.process.executable):
+            return 'task executable already running'
+        elif task.stop and not is_running(task.process.executable):
+            return 'task executable already stopped'
 
-        # -- Sort conditions
-        def k(e): return e.order
-        conditions = [c for c in task.conditions]
-        conditions.sort(key=k)
+        return ''
 
-        # -- Check task conditions
-        for condition in conditions:
-            condition_executable_path = Path(condition.process.path) / condition.process.executable
+    @staticmethod
+    def _check_task_ready(task: TaskRule, is_running: Callable[[str], bool]) -> bool:
+        """ Check that the task is active and its executable exists and is not already running/stopped """
+        reason = TaskManager._task_not_ready(task, is_running)
+        if reason:
+            logging.debug('Task %s skipped: %s.', task.name, reason)
+        return not reason
 
-            process_running = is_process_running(condition.process.executable)
-            if not condition_executable_path.exists() or not condition.process.executable:
-                process_running = False
+    @staticmethod
+    def _check_task_conditions(task: TaskRule, is_running: Callable[[str], bool] = None) -> bool:
+        """ Check if all conditions for a task are met
 
-            results.append(
-                condition.running == process_running
-                )
+        :param Task task: the task whose conditions should be tested
+        :param is_running: running check of the current evaluation, see process_lookup
+        :returns: True if all conditions where met. Also True if no conditions present.
+        """
+        is_running = is_running or TaskManager.process_lookup()
+        if not TaskManager._check_task_ready(task, is_running):
+            return False
 
-            if condition.running == process_running and TaskManager.debug_conditions:
-                logging.debug(f'Task {task.name} condition "if {condition.process.executable} {d[condition.running]}"'
-                              f' met: {condition.process.executable} {d[process_running]}.')
-            elif TaskManager.debug_conditions:
+        d = {False: 'is not running', True: 'is running'}
+
+        # -- Check task conditions, the compiled expression only checks conditions the result depends on
+        def is_met(condition: ConditionRule) -> bool:
+            process_running = condition.process.exists and is_running(condition.process.executable)
+
+            met = condition.running == process_running
+            if TaskManager.debug_conditions:
                 logging.debug(f'Task {task.name} condition "if {condition.process.executable} {d[condition.running]}"'
-                              f' NOT met: {condition.process.executable} {d[process_running]}.')
+                              f' {"met" if met else "NOT met"}: {condition.process.executable} {d[process_running]}.')
+            return met
 
-        gates = [g for g in task.gates]
-        return CheckConditionsGated.check_conditions(results, gates, TaskManager.debug_conditions)
+        return task.expression.evaluate(is_met)
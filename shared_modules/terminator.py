@@ -0,0 +1,242 @@
+""" Stop processes gracefully: request a close, wait for a bounded time, then terminate the survivors.
+
+    All processes of one stop request are asked to close at once and share one timeout window, so
+    stopping several apps takes as long as the slowest of them and not the sum of them.
+"""
+import logging
+import os
+import signal
+import sys
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+if sys.platform == 'win32':
+    import pywintypes
+    import win32api
+    import win32con
+    import win32event
+    import win32gui
+    import win32process
+    import wmi
+else:
+    from . import procfs
+
+# -- Outcomes of stopping a process
+CLOSED = 'closed'
+TERMINATED = 'terminated'
+FAILED = 'failed'
+
+
+class StopResult(NamedTuple):
+    pid: int
+    executable: str
+    # closed: exited after the close request, terminated: exited after it was forced to, failed: still running
+    outcome: str
+    # Seconds from the stop request until the process exited or was given up
+    duration: float
+    error: str = ''
+
+    @property
+    def success(self) -> bool:
+        return self.outcome != FAILED
+
+
+class _Process:
+    """ A process being stopped. On Windows a handle is held so its pid can not be reused meanwhile. """
+
+    def __init__(self, pid: int, executable: str, start_time: int = 0):
+        self.pid, self.executable, self.start_time = pid, executable, start_time
+        self.handle = None
+        self.error = ''
+
+        if sys.platform == 'win32':
+            try:
+                self.handle = win32api.OpenProcess(win32con.SYNCHRONIZE | win32con.PROCESS_TERMINATE, False, pid)
+            except pywintypes.error as e:
+                self.error = str(e)
+
+    def alive(self) -> bool:
+        if sys.platform != 'win32':
+            return procfs.is_alive(self.pid, self.start_time)
+        return win32event.WaitForSingleObject(self.handle, 0) == win32event.WAIT_TIMEOUT
+
+    def request_close(self, windows: Optional[Dict[int, List[int]]]) -> bool:
+        """ Ask the process to exit, returns False if it can not be asked """
+        try:
+            if sys.platform != 'win32':
+                os.kill(self.pid, signal.SIGTERM)
+                return True
+
+            # - Only processes with top level windows can be closed like the user would close them
+            hwnds = windows.get(self.pid, list())
+            for hwnd in hwnds:
+                win32gui.PostMessage(hwnd, win32con.WM_CLOSE, 0, 0)
+            return bool(hwnds)
+        except Exception as e:
+            logging.debug('Could not request process %s #%s to close: %s', self.executable, self.pid, e)
+            return False
+
+    def terminate(self):
+        if sys.platform != 'win32':
+            os.kill(self.pid, signal.SIGKILL)
+        else:
+            win32api.TerminateProcess(self.handle, 1)
+
+    def release(self):
+        if self.handle is not None:
+            win32api.CloseHandle(self.handle)
+            self.handle = None
+
+
+def running_process_names() -> Set[str]:
+    """ Enumerate all running processes at once
+
+    :returns: casefolded executable names of all running processes
+    """
+    if sys.platform != 'win32':
+        return {info.name.casefold() for info in procfs.snapshot().values()}
+
+    c = wmi.WMI(find_classes=False)
+    try:
+        return {p.Name.casefold() for p in c.query('SELECT Name FROM Win32_Process') if p.Name}
+    except pywintypes.com_error as err:
+        logging.error(err)
+
+    return set()
+
+
+def is_pid_running(pid: int) -> bool:
+    """ Check whether a process of this pid is running, processes we may not open count as running """
+    if sys.platform != 'win32':
+        return procfs.is_alive(pid)
+
+    try:
+        handle = win32api.OpenProcess(win32con.SYNCHRONIZE, False, pid)
+    except pywintypes.error as e:
+        # ERROR_ACCESS_DENIED: the process exists
+        return e.winerror == 5
+    try:
+        return win32event.WaitForSingleObject(handle, 0) == win32event.WAIT_TIMEOUT
+    finally:
+        win32api.CloseHandle(handle)
+
+
+def _find_processes(executables: Iterable[str]) -> List[_Process]:
+    """ Find all running processes of these executable names, enumerating the processes once """
+    names = {e.casefold() for e in executables if e}
+    if not names:
+        return list()
+
+    if sys.platform != 'win32':
+        return [_Process(info.pid, info.name, info.start_time) for info in procfs.snapshot().values()
+                if info.name.casefold() in names]
+
+    c = wmi.WMI(find_classes=False)
+    try:
+        return [_Process(p.ProcessId, p.Name) for p in c.query('SELECT ProcessId, Name FROM Win32_Process')
+                if p.Name and p.Name.casefold() in names]
+    except pywintypes.com_error as err:
+        logging.error(err)
+
+    return list()
+
+
+def _windows_by_pid() -> Optional[Dict[int, List[int]]]:
+    """ Visible top level windows of all processes, None on platforms without windows to close """
+    if sys.platform != 'win32':
+        return None
+
+    windows: Dict[int, List[int]] = dict()
+
+    def collect(hwnd, _):
+        if win32gui.IsWindowVisible(hwnd):
+            _, pid = win32process.GetWindowThreadProcessId(hwnd)
+            windows.setdefault(pid, list()).append(hwnd)
+        return True
+
+    win32gui.EnumWindows(collect, None)
+    return windows
+
+
+class ProcessTerminator:
+    """ Stop all processes of a set of executables in parallel, closing them gracefully first.
+
+        Processes that do not exit within close_timeout_secs of the close request, or that can not be
+        asked to close eg. console apps without a window, are terminated. Blocking, call it from a
+        worker thread.
+    """
+    # -- Seconds processes get to exit after the close request before they are terminated
+    close_timeout_secs = 5.0
+
+    # -- Seconds terminated processes get to exit before they are reported as failed
+    terminate_timeout_secs = 2.0
+
+    # -- Seconds between checks whether the processes exited
+    poll_interval_secs = 0.05
+
+    def stop(self, executables: Iterable[str], graceful: bool = True) -> List[StopResult]:
+        """ Stop all running processes of these executables
+
+        :param executables: executable names eg. 'obs64.exe'
+        :param graceful: request the processes to close before terminating them
+        :returns: outcome and timing of every process found, empty if none was running
+        """
+        processes = _find_processes(executables)
+        start = time.perf_counter()
+        results: Dict[int, StopResult] = dict()
+
+        try:
+            survivors = list()
+            for p in processes:
+                if p.error:
+                    results[p.pid] = StopResult(p.pid, p.executable, FAILED, 0.0, p.error)
+                elif p.alive():
+                    survivors.append(p)
+                else:
+                    results[p.pid] = StopResult(p.pid, p.executable, CLOSED, 0.0)
+
+            # -- Ask all processes to close at once and wait for them together
+            if graceful and survivors:
+                windows = _windows_by_pid()
+                closing = [p for p in survivors if p.request_close(windows)]
+                survivors = [p for p in survivors if p not in closing]
+                survivors += self._wait(closing, self.close_timeout_secs, start, CLOSED, results)
+
+            # -- Force the remaining processes to exit
+            terminated = list()
+            for p in survivors:
+                try:
+                    p.terminate()
+                    terminated.append(p)
+                except Exception as e:
+                    results[p.pid] = StopResult(p.pid, p.executable, FAILED, time.perf_counter() - start, str(e))
+
+            for p in self._wait(terminated, self.terminate_timeout_secs, start, TERMINATED, results):
+                results[p.pid] = StopResult(p.pid, p.executable, FAILED, time.perf_counter() - start,
+                                            'still running after terminate')
+        finally:
+            for p in processes:
+                p.release()
+
+        return [results[p.pid] for p in processes]
+
+    def _wait(self, processes: List[_Process], timeout: float, start: float, outcome: str,
+              results: Dict[int, StopResult]) -> List[_Process]:
+        """ Wait until the processes exited or the timeout passed
+
+        :returns: processes still running
+        """
+        deadline = time.perf_counter() + timeout
+        pending = list(processes)
+
+        while pending:
+            now = time.perf_counter()
+            for p in [p for p in pending if not p.alive()]:
+                results[p.pid] = StopResult(p.pid, p.executable, outcome, now - start)
+                pending.remove(p)
+
+            if not pending or now >= deadline:
+                break
+            time.sleep(min(self.poll_interval_secs, deadline - now))
+
+        return pending
@@ -1,36 +1,63 @@
 import logging
-from pathlib import Path
-from typing import Iterator, List
+import sys
+import time
+from typing import Iterable, Iterator, List
 
-import pywintypes
-import win32api
-import win32con
-import win32event
-import win32process
-import wmi
-from win32com.shell import shellcon
-from win32com.shell.shell import ShellExecuteEx
+from sqlalchemy import event
+from sqlalchemy.orm import selectinload
 
-from .models import Gate, Profile
+from .models import Condition, Profile, Task
+
+if sys.platform == 'win32':
+    import pywintypes
+    import win32api
+    import win32con
+    import win32event
+    import win32process
+    from win32com.shell import shellcon
+    from win32com.shell.shell import ShellExecuteEx
 
 
 def iterate_profiles(session) -> Iterator[Profile]:
-    for profile in session.query(Profile).all():
+    for profile in load_profiles(session, active_only=False):
         yield profile
 
 
-def match_profiles(profiles: List[Profile], process_name: str):
-    # -- Find profiles this executable has 'hit'
-    active_profiles = list()
+def load_profiles(session, active_only: bool = True, profile_ids: Iterable[int] = None) -> List[Profile]:
+    """ Load profiles with their processes, tasks, conditions and gates in a constant number of queries
+        instead of one query per lazy loaded relationship. Logs the number of queries and the load time.
 
-    for profile in profiles:
-        for process in profile.processes:
-            if process_name.casefold() == process.executable.casefold():
-                active_profiles.append(profile)
-                logging.debug('Process %s matched profile %s', process_name, profile.name)
-                break
+    :param session: session to load with
+    :param active_only: skip in-active profiles
+    :param profile_ids: only load these profiles, all profiles if None
+    """
+    query = session.query(Profile).options(
+        selectinload(Profile.processes),
+        selectinload(Profile.tasks).joinedload(Task.process),
+        selectinload(Profile.tasks).selectinload(Task.conditions).joinedload(Condition.process),
+        selectinload(Profile.tasks).selectinload(Task.gates),
+    ).order_by(Profile.id)
+    if active_only:
+        query = query.filter(Profile.active.is_(True))
+    if profile_ids is not None:
+        query = query.filter(Profile.id.in_(list(profile_ids)))
+
+    # -- Count the statements of this session only, other threads may use the same engine
+    connection, queries = session.connection(), [0]
+
+    def count(*_):
+        queries[0] += 1
+
+    start = time.perf_counter()
+    event.listen(connection, 'before_cursor_execute', count)
+    try:
+        profiles = query.all()
+    finally:
+        event.remove(connection, 'before_cursor_execute', count)
 
-    return active_profiles
+    logging.info('Loaded %s profiles with %s queries in %.1f ms', len(profiles), queries[0],
+                 (time.perf_counter() - start) * 1000)
+    return profiles
 
 
 def run_as_admin(cmd, parameters, wait=True):
@@ -104,80 +131,3 @@ def get_file_properties(file_path: str):
     return props
 
 
-def is_process_running(executable_name: str) -> bool:
-    c = wmi.WMI(find_classes=False)
-    try:
-        r = c.Win32_Process(Name=executable_name)
-        if r:
-            return True
-    except pywintypes.com_error as err:
-        logging.error(err)
-
-    return False
-
-
-class CheckConditionsGated:
-    """
-        Check a list of conditions with a list of logic gates:
-            conditions: True, False, True
-            gates: AND, OR
-            -> True AND False OR True
-            -> overall_result: True
-    """
-    @staticmethod
-    def print_condition_overview(conditions: list):
-        txt_block = ''
-        for c in conditions:
-            if isinstance(c, Gate):
-                txt_block += f" {'AND' if c.value else 'OR'}"
-            else:
-                txt_block += f" {c}"
-        txt_block = txt_block[1:]  # remove leading space
-
-        logging.debug(f"Conditions: {txt_block}")
-
-    @staticmethod
-    def _check_condition_gate(a: bool, b: bool, gate: Gate) -> bool:
-        if gate.value is True:  # AND
-            if a and b:
-                return True
-        elif gate.value is False:  # OR
-            if a or b:
-                return True
-        return False
-
-    @classmethod
-    def check_conditions(cls, conditions: List[bool], gates_ls: List[Gate], debug_conditions: bool = False):
-        if len(conditions) == 1:
-            return conditions[0]
-
-        condition_gate_ls = list()
-        for idx, c in enumerate(conditions):
-            if idx >= 1:
-                condition_gate_ls.append(gates_ls.pop(0))
-            condition_gate_ls.append(c)
-
-        prev_condition, current_gate = None, None
-        last_result, overall_result, idx = False, True, 0
-
-        if debug_conditions:
-            cls.print_condition_overview(condition_gate_ls)
-
-        for c in condition_gate_ls:
-            if isinstance(c, Gate):
-                current_gate = c
-                continue
-
-            if prev_condition is None:
-                prev_condition = c
-                continue
-
-            current_result = cls._check_condition_gate(prev_condition, c, current_gate)
-            idx += 1
-            if debug_conditions:
-                logging.debug(
-                    f"#{idx} {prev_condition} {'AND' if current_gate.value else 'OR'} {c} = {current_result}")
-            prev_condition = current_result
-            overall_result = current_result
-
-        return overall_result
@@ -7,7 +7,7 @@ import shiboken2
 from modules import log_listener
 from modules.app import SimmonApp
 from shared_modules.globals import APP_FRIENDLY_NAME
-from shared_modules.migrate import db_engine, db_session
+from shared_modules.migrate import init_database
 from ui import gui_resource
 
 VERSION = '0.95'
@@ -22,6 +22,7 @@ def main():
     logging.info('########################################')
     logging.info('%s v%s started', APP_FRIENDLY_NAME, VERSION)
     logging.info('Shiboken2: %s', shiboken2.__version__)
+    db_engine, db_session = init_database()
     gui_resource.qInitResources()
     logging.debug('Log queue: %s', log_listener.queue)
     app = SimmonApp(VERSION, db_engine, db_session, log_listener.queue)
@@ -1,7 +1,9 @@
+import argparse
 import logging
 import signal
 import sys
 import threading
+from pathlib import Path
 
 from watcher import log_listener
 from watcher.watcher_app import WatcherApp
@@ -18,7 +20,16 @@ def service_shutdown():
     EXIT_EVENT.set()
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description=f'{WATCHER_NAME} background service')
+    parser.add_argument('--trace', type=Path, default=None,
+                        help='record all received process events to this trace file')
+    args, _ = parser.parse_known_args()
+    return args
+
+
 def main(version):
+    args = parse_args()
     s = SingleInstance(flavor_id='SimmonWatcherInstance')  # will sys.exit(-1) if another instance is running
 
     logging.info('---')
@@ -29,7 +40,7 @@ def main(version):
     signal.signal(signal.SIGTERM, service_shutdown)
     signal.signal(signal.SIGINT, service_shutdown)
 
-    app = WatcherApp(EXIT_EVENT)
+    app = WatcherApp(EXIT_EVENT, trace_file=args.trace)
 
     try:
         app.app_loop()
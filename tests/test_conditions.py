@@ -0,0 +1,119 @@
+""" Compiled condition expressions and bitsets against the gate evaluation they replaced
+
+        python -m pytest tests
+"""
+import itertools
+import random
+import unittest
+from typing import List, Sequence
+
+from shared_modules.bitsets import ConditionBitsets
+from shared_modules.rules import ConditionExpression, ConditionRule, GateRule, ProcessRule, TaskRule
+
+PROCESSES = [ProcessRule(f'app{idx}.exe', 'C:\\Apps', True) for idx in range(4)]
+
+
+def gated_left_to_right(conditions: List[bool], gates: List[bool]) -> bool:
+    """ The evaluation of the former utils.CheckConditionsGated: strictly left to right """
+    if not conditions:
+        return True
+
+    result = conditions[0]
+    for gate, condition in zip(gates, conditions[1:]):
+        result = (result and condition) if gate else (result or condition)
+    return result
+
+
+def gated_and_precedence(conditions: List[bool], gates: List[bool]) -> bool:
+    """ Python operator precedence: AND binds stronger than OR """
+    if not conditions:
+        return True
+
+    source = str(conditions[0])
+    for gate, condition in zip(gates, conditions[1:]):
+        source += f" {'and' if gate else 'or'} {condition}"
+    return eval(source)
+
+
+def task_rule(task_id: int, conditions: Sequence[ConditionRule], gates: Sequence[GateRule],
+              and_precedence: bool) -> TaskRule:
+    conditions, gates = tuple(conditions), tuple(gates)
+    return TaskRule(task_id, 1, f'Task {task_id}', True, False, True, '', '', False, False,
+                    ProcessRule('task.exe', 'C:\\Apps', True), conditions, gates,
+                    ConditionExpression(conditions, gates, and_precedence))
+
+
+class ConditionEquivalenceTest(unittest.TestCase):
+    @staticmethod
+    def reference(and_precedence: bool):
+        return gated_and_precedence if and_precedence else gated_left_to_right
+
+    def check(self, tasks: List[TaskRule], running: set, and_precedence: bool):
+        def is_met(condition: ConditionRule) -> bool:
+            return condition.running == (condition.process.executable in running)
+
+        expected = [self.reference(and_precedence)([is_met(c) for c in task.conditions],
+                                                   [g.value for g in task.gates]) for task in tasks]
+
+        evaluated = [task.expression.evaluate(is_met) for task in tasks]
+        batched = ConditionBitsets(tasks).evaluate(tasks, lambda name: name in running)
+
+        # Compare the ids of mismatching tasks, diffs of thousands of results are of no help
+        self.assertEqual([t.id for t, e, r in zip(tasks, expected, evaluated) if e != r], [])
+        self.assertEqual([t.id for t, e, r in zip(tasks, expected, batched) if e != r], [])
+
+    def test_every_chain_of_distinct_processes(self):
+        """ All gate combinations of up to four conditions in every running state """
+        for and_precedence in (False, True):
+            tasks, task_id = list(), 0
+            for length in range(len(PROCESSES) + 1):
+                for wanted in itertools.product((True, False), repeat=length):
+                    conditions = [ConditionRule(p, w, idx) for idx, (p, w) in enumerate(zip(PROCESSES, wanted))]
+                    for gates in itertools.product((True, False), repeat=max(length - 1, 0)):
+                        task_id += 1
+                        tasks.append(task_rule(task_id, conditions, [GateRule(i, g) for i, g in enumerate(gates)],
+                                               and_precedence))
+
+            for count in range(len(PROCESSES) + 1):
+                for running in itertools.combinations(PROCESSES, count):
+                    with self.subTest(and_precedence=and_precedence, running=running):
+                        self.check(tasks, {p.executable for p in running}, and_precedence)
+
+    def test_random_chains(self):
+        """ Chains repeating processes, with shuffled gate and condition order """
+        rnd = random.Random(16)
+
+        for and_precedence in (False, True):
+            tasks = list()
+            for task_id in range(500):
+                length = rnd.randint(0, 7)
+                conditions = [ConditionRule(rnd.choice(PROCESSES), rnd.random() < 0.5, idx) for idx in range(length)]
+                gates = [GateRule(idx, rnd.random() < 0.5) for idx in range(max(length - 1, 0))]
+                rnd.shuffle(gates)
+                tasks.append(task_rule(task_id, sorted(conditions, key=lambda c: c.order), gates, and_precedence))
+
+            # The reference gets the gates in order like the GUI shows them
+            tasks = [t._replace(gates=tuple(sorted(t.gates, key=lambda g: g.order))) for t in tasks]
+
+            for _ in range(50):
+                running = {p.executable for p in PROCESSES if rnd.random() < 0.5}
+                with self.subTest(and_precedence=and_precedence, running=running):
+                    self.check(tasks, running, and_precedence)
+
+    def test_missing_gates_default_to_and(self):
+        conditions = [ConditionRule(p, True, idx) for idx, p in enumerate(PROCESSES[:3])]
+        task = task_rule(1, conditions, [GateRule(0, False)], False)
+
+        # (app0 OR app1) AND app2
+        for running, expected in (({'app1.exe'}, False), ({'app1.exe', 'app2.exe'}, True)):
+            self.assertEqual(task.expression.evaluate(lambda c: c.process.executable in running), expected)
+            self.assertEqual(ConditionBitsets([task]).evaluate([task], lambda name: name in running), [expected])
+
+    def test_not_existing_process_never_runs(self):
+        process = ProcessRule('missing.exe', 'C:\\Apps', False)
+        task = task_rule(1, [ConditionRule(process, False, 0)], [], False)
+        self.assertEqual(ConditionBitsets([task]).evaluate([task], lambda name: True), [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
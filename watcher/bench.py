@@ -0,0 +1,303 @@
+""" Measure the latency from a process event to the launch of the follow-up tasks.
+
+    Drives a Watchlet with a synthetic event source and a stub launcher against a temporary
+    database of generated profiles. Scenarios are given as profiles x tasks x conditions.
+
+        python -m watcher.bench --scenario 1x1x1 --scenario 50x5x5 --output bench.json
+        python -m watcher.bench --baseline bench.json
+
+    Latencies start when the event is handed to the watcher. They do not include the detection
+    delay of the platform event source, eg. the WITHIN polling interval of WMI.
+"""
+import argparse
+import json
+import logging
+import platform
+import queue
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import sqlalchemy as db
+
+from shared_modules.launcher import LaunchTracker
+from shared_modules.migrate import Session, db_engine
+from shared_modules.models import Base, Condition, Gate, Profile, Process, Task
+from shared_modules.taskmanager import TaskManager
+from . import log_listener
+from .event_source import EventSubscription, ProcessEvent, ProcessEventSource
+from .process_watcher import ProcessWatcher
+from .watchlet import Watchlet
+
+
+class Scenario(NamedTuple):
+    profiles: int
+    tasks: int
+    conditions: int
+
+    @classmethod
+    def parse(cls, value: str) -> 'Scenario':
+        try:
+            profiles, tasks, conditions = (int(v) for v in value.lower().split('x'))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'Scenario must be given as profiles x tasks x conditions eg. 10x3x3: '
+                                             f'{value}')
+        return cls(max(1, profiles), max(1, tasks), max(0, conditions))
+
+    def __str__(self):
+        return f'{self.profiles}x{self.tasks}x{self.conditions}'
+
+
+class SyntheticSubscription(EventSubscription):
+    def __init__(self, events: queue.Queue):
+        self.events = events
+
+    def next_event(self, timeout_ms: int) -> Optional[ProcessEvent]:
+        try:
+            return self.events.get(timeout=timeout_ms * 0.001)
+        except queue.Empty:
+            return
+
+    def update(self, process_names: set, notification_types: set) -> bool:
+        return True
+
+
+class SyntheticEventSource(ProcessEventSource):
+    """ Report process creation events injected by the benchmark """
+    name = 'synthetic'
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self.subscribed = threading.Event()
+        self._pid = 10000
+
+    def subscribe(self, process_names: set, notification_types: set) -> SyntheticSubscription:
+        self.subscribed.set()
+        return SyntheticSubscription(self.events)
+
+    def enumerate_processes(self, process_names: set) -> List[Tuple[str, int]]:
+        return list()
+
+    def inject(self, name: str) -> float:
+        """ Report the creation of a new process, returns the perf_counter time of the injection """
+        self._pid += 1
+        injected = time.perf_counter()
+        self.events.put(ProcessEvent(name, self._pid, 'Creation', str(self._pid)))
+        return injected
+
+
+class StubLauncher:
+    """ Record the launch times of tasks by profile instead of executing them """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._launched = threading.Condition(self._lock)
+        self.launches: Dict[int, List[float]] = dict()
+
+    def __call__(self, tasks: List[Task]):
+        launched = time.perf_counter()
+        with self._launched:
+            for profile_id in {t.profile_id for t in tasks}:
+                self.launches.setdefault(profile_id, list()).append(launched)
+            self._launched.notify_all()
+
+    def wait_for(self, profile_ids: set, since: float, timeout: float) -> Dict[int, float]:
+        """ Wait until each profile launched tasks after since
+
+        :returns: first launch time by profile id, profiles that timed out are missing
+        """
+        deadline = time.perf_counter() + timeout
+
+        with self._launched:
+            while True:
+                found = dict()
+                for profile_id in profile_ids:
+                    times = [t for t in self.launches.get(profile_id, list()) if t >= since]
+                    if times:
+                        found[profile_id] = min(times)
+
+                remaining = deadline - time.perf_counter()
+                if len(found) == len(profile_ids) or remaining <= 0:
+                    return found
+                self._launched.wait(remaining)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """ Linear interpolated percentile of values, p in the range 0-100 """
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def summarize(latencies: List[float]) -> dict:
+    ms = [v * 1000 for v in latencies]
+    return {'samples': len(ms), 'min_ms': round(min(ms, default=0.0), 3),
+            'mean_ms': round(sum(ms) / len(ms), 3) if ms else 0.0,
+            'p50_ms': round(percentile(ms, 50), 3), 'p95_ms': round(percentile(ms, 95), 3),
+            'p99_ms': round(percentile(ms, 99), 3), 'max_ms': round(max(ms, default=0.0), 3)}
+
+
+def trigger_name(profile_idx: int) -> str:
+    return f'bench_trigger_{profile_idx}.exe'
+
+
+def create_profiles(session, scenario: Scenario, work_dir: Path):
+    """ Create profiles whose tasks are activated by their trigger process and always pass their conditions """
+    # -- Task executables need to exist, use our own interpreter and allow it to run multiple times
+    task_executable = Path(sys.executable)
+    # -- Condition executables do not exist and are never running
+    condition_dir = work_dir / 'missing'
+
+    for p_idx in range(scenario.profiles):
+        tasks = list()
+        for t_idx in range(scenario.tasks):
+            conditions = [Condition(name=f'c{c_idx}', order=c_idx, running=False,
+                                    process=Process(executable=f'bench_condition_{c_idx}.exe',
+                                                    path=condition_dir.as_posix()))
+                          for c_idx in range(scenario.conditions)]
+            gates = [Gate(order=g_idx, value=True) for g_idx in range(max(0, scenario.conditions - 1))]
+            tasks.append(Task(name=f't{p_idx}_{t_idx}', allow_multiple_instances=True, conditions=conditions,
+                              gates=gates, process=Process(executable=task_executable.name,
+                                                           path=task_executable.parent.as_posix())))
+
+        # -- Profile processes are only watched if their executable exists
+        (work_dir / trigger_name(p_idx)).touch()
+        trigger = Process(executable=trigger_name(p_idx), path=work_dir.as_posix(), notification_type='Creation')
+        session.add(Profile(name=f'bench_{p_idx}', processes=[trigger], tasks=tasks))
+
+    session.commit()
+
+
+def run_scenario(scenario: Scenario, samples: int, burst: int, timeout: float) -> dict:
+    """ Run the latency and burst phase of one scenario against a temporary database """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = db.create_engine(f'sqlite:///{Path(tmp_dir).as_posix()}/bench.sqlite3')
+        Base.metadata.create_all(engine)
+
+        Session.remove()
+        Session.configure(bind=engine)
+        source, launcher = SyntheticEventSource(), StubLauncher()
+        TaskManager.execute_hook = launcher
+        # -- Every sample launches the same tasks again, measure without launch cooldown
+        launch_tracker, TaskManager.launch_tracker = TaskManager.launch_tracker, LaunchTracker()
+        TaskManager.launch_tracker.cooldown_secs = 0.0
+        exit_event = threading.Event()
+        watchlet = None
+
+        try:
+            session = Session()
+            create_profiles(session, scenario, Path(tmp_dir))
+            profile_ids = [p.id for p in session.query(Profile).order_by(Profile.id)]
+            rules = TaskManager.load_rules()
+            Session.remove()
+
+            watchlet = Watchlet(rules, exit_event, source)
+            watchlet.start()
+            source.subscribed.wait(timeout)
+
+            # -- Latency: one event at a time, rotating through the profiles
+            latencies, timeouts = list(), 0
+            for idx in range(samples):
+                p_idx = idx % scenario.profiles
+                injected = source.inject(trigger_name(p_idx))
+                launched = launcher.wait_for({profile_ids[p_idx]}, injected, timeout)
+                if launched:
+                    latencies.append(launched[profile_ids[p_idx]] - injected)
+                else:
+                    timeouts += 1
+
+            # -- Burst: inject all events at once and wait for every hit profile to launch its tasks
+            hit = {profile_ids[idx % scenario.profiles] for idx in range(burst)}
+            burst_start = time.perf_counter()
+            for idx in range(burst):
+                source.inject(trigger_name(idx % scenario.profiles))
+            launched = launcher.wait_for(hit, burst_start, timeout)
+            elapsed = (max(launched.values()) - burst_start) if launched else 0.0
+        finally:
+            if watchlet is not None:
+                watchlet.stop()
+                watchlet.join()
+            TaskManager.execute_hook = None
+            TaskManager.launch_tracker = launch_tracker
+            Session.remove()
+            Session.configure(bind=db_engine)
+            engine.dispose()
+
+    latency = summarize(latencies)
+    latency['timeouts'] = timeouts
+    result = {'scenario': str(scenario), 'profiles': scenario.profiles, 'tasks': scenario.tasks,
+              'conditions': scenario.conditions, 'latency': latency,
+              'burst': {'events': burst, 'profiles': len(hit), 'launched_profiles': len(launched),
+                        'elapsed_ms': round(elapsed * 1000, 3),
+                        'events_per_sec': round(burst / elapsed, 3) if elapsed else 0.0}}
+
+    logging.warning('%s p50 %.1f ms p95 %.1f ms p99 %.1f ms, %s timeouts | burst of %s: %.1f events/s',
+                    scenario, latency['p50_ms'], latency['p95_ms'], latency['p99_ms'], timeouts, burst,
+                    result['burst']['events_per_sec'])
+    return result
+
+
+def compare(results: dict, baseline_file: Path):
+    """ Log the change of each scenario against a previously saved run """
+    with open(baseline_file.as_posix(), 'r', encoding='utf-8') as f:
+        baseline = {s['scenario']: s for s in json.load(f).get('scenarios', list())}
+
+    for scenario in results['scenarios']:
+        before = baseline.get(scenario['scenario'])
+        if before is None:
+            logging.warning('%s not found in baseline', scenario['scenario'])
+            continue
+
+        changes = list()
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = before['latency'][key], scenario['latency'][key]
+            changes.append(f'{key} {old:.1f} -> {new:.1f}')
+        old, new = before['burst']['events_per_sec'], scenario['burst']['events_per_sec']
+        changes.append(f'events/s {old:.1f} -> {new:.1f}')
+        logging.warning('%s %s', scenario['scenario'], ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the trigger latency of the watcher.')
+    parser.add_argument('--scenario', type=Scenario.parse, action='append', default=None,
+                        help='profiles x tasks x conditions eg. 10x3x3, may be repeated. '
+                             'Default: 1x1x1 10x3x3 50x5x5')
+    parser.add_argument('--samples', type=int, default=10, help='latency samples per scenario, default: 10')
+    parser.add_argument('--burst', type=int, default=20, help='events per burst, default: 20')
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help='seconds to wait for task launches of a sample or burst, default: 120')
+    parser.add_argument('--output', type=Path, default=None, help='save results to this JSON file')
+    parser.add_argument('--baseline', type=Path, default=None, help='compare results to a saved JSON file')
+    parser.add_argument('--verbose', action='store_true', help='show watcher debug logging')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+    scenarios = args.scenario or [Scenario(1, 1, 1), Scenario(10, 3, 3), Scenario(50, 5, 5)]
+
+    results = {'created': datetime.now().isoformat(timespec='seconds'), 'platform': platform.platform(),
+               'python': platform.python_version(), 'samples': args.samples, 'burst': args.burst,
+               'detection_delay_not_included_secs': ProcessWatcher.polling_interval,
+               'scenarios': [run_scenario(s, args.samples, args.burst, args.timeout) for s in scenarios]}
+
+    if args.output:
+        with open(args.output.as_posix(), 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        logging.warning('Saved results to %s', args.output.as_posix())
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+    # -- Flush the log queue before the interpreter exits
+    log_listener.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from .event_source import ProcessEvent
+
+
+class EventDeduplicator:
+    """ Collapse repeated reports of the same process event eg. from overlapping subscriptions.
+
+        Events are keyed by notification type, executable, process id and creation time so
+        distinct processes always pass. Keys are remembered for ttl_secs, at most max_size keys are kept.
+    """
+    def __init__(self, ttl_secs: float, max_size: int = 256):
+        self.ttl_secs = ttl_secs
+        self.max_size = max_size
+
+        # key -> monotonic time the key was last seen, oldest first
+        self._seen: OrderedDict = OrderedDict()
+
+        self.collapsed = 0
+        self.forwarded = 0
+
+    @staticmethod
+    def event_key(event: ProcessEvent) -> Tuple[str, str, int, str]:
+        return event.notification_type, event.name.casefold(), event.pid, event.creation_date
+
+    def _expire(self, now: float):
+        while self._seen:
+            key, seen = next(iter(self._seen.items()))
+            if now - seen < self.ttl_secs:
+                break
+            self._seen.popitem(last=False)
+
+    def is_duplicate(self, event: ProcessEvent) -> bool:
+        """ Report if the event was already seen and remember it otherwise """
+        now = time.monotonic()
+        self._expire(now)
+
+        key = self.event_key(event)
+        if key in self._seen:
+            self._seen[key] = now
+            self._seen.move_to_end(key)
+            self.collapsed += 1
+            return True
+
+        self._seen[key] = now
+        if len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+
+        self.forwarded += 1
+        return False
+
+    def log_stats(self):
+        logging.debug('Event deduplication forwarded %s and collapsed %s events.', self.forwarded, self.collapsed)
@@ -0,0 +1,100 @@
+import sys
+from typing import FrozenSet, List, NamedTuple, Optional, Tuple
+
+
+class EventSourceError(Exception):
+    """ Raised by a ProcessEventSource if the platform backend reported an error """
+    pass
+
+
+class ProcessEvent(NamedTuple):
+    """ A single process event as reported by a ProcessEventSource """
+    name: str
+    pid: int
+    notification_type: str
+    # Process creation time as reported by the source, together with the pid this identifies a process
+    creation_date: str = ''
+    parent_pid: int = 0
+
+
+class ProcessSnapshot(NamedTuple):
+    """ All running processes of the watched process names at one point in time """
+    # Casefolded process names this snapshot is complete for, all names if empty
+    process_names: FrozenSet[str]
+    # (name, pid) of each running process
+    processes: Tuple[Tuple[str, int], ...]
+
+
+class EventSubscription:
+    """ Handle to an open subscription of a ProcessEventSource """
+    def next_event(self, timeout_ms: int) -> Optional[ProcessEvent]:
+        """ Block until the next matching event arrives or timeout_ms passed.
+
+        :param timeout_ms: Milliseconds to wait for an event
+        :returns: the next ProcessEvent or None on timeout
+        """
+        raise NotImplementedError
+
+    def update(self, process_names: set, notification_types: set) -> bool:
+        """ Change the watched process names and notification types of this open subscription.
+
+        :returns: False if the source can not update a subscription in place
+        """
+        return False
+
+    def close(self):
+        """ Release the resources of this subscription """
+        pass
+
+
+class ProcessEventSource:
+    """ Platform specific provider of process creation/deletion events.
+
+        A source is shared by the threads of a Watchlet. Every thread using it needs to call
+        thread_init before and thread_uninit after using the source, eg. to set up COM on Windows.
+    """
+    name = ''
+
+    # -- Seconds between two polls of the process list
+    #    we will receive updates in this interval
+    polling_interval = 8
+
+    def thread_init(self):
+        pass
+
+    def thread_uninit(self):
+        pass
+
+    def subscribe(self, process_names: set, notification_types: set) -> EventSubscription:
+        """ Subscribe to events of all given notification types at once.
+
+        :param process_names: executable names to watch for. Watch all processes if empty.
+        :param notification_types: set of “Creation”, “Deletion”, “Modification” or “Operation”
+        """
+        raise NotImplementedError
+
+    def enumerate_processes(self, process_names: set) -> List[Tuple[str, int]]:
+        """ List all running processes
+
+        :param process_names: only list processes with these executable names. List all processes if empty.
+        :returns: list of (name, pid) tuples
+        """
+        raise NotImplementedError
+
+
+def create_event_source(name: str = '') -> ProcessEventSource:
+    """ Create the ProcessEventSource by name or the default source for this platform
+
+    :param name: 'wmi' or 'proc'. Leave empty to choose by platform.
+    """
+    if not name:
+        name = 'wmi' if sys.platform == 'win32' else 'proc'
+
+    if name == 'wmi':
+        from .wmi_source import WmiEventSource
+        return WmiEventSource()
+    elif name == 'proc':
+        from .proc_source import ProcEventSource
+        return ProcEventSource()
+
+    raise ValueError(f'Unknown process event source: {name}')
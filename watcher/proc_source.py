@@ -0,0 +1,79 @@
+import logging
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+
+from shared_modules import procfs
+from .event_source import EventSubscription, ProcessEvent, ProcessEventSource
+
+
+class ProcSubscription(EventSubscription):
+    """ Detect process events by comparing snapshots of /proc """
+    def __init__(self, process_names: set, notification_types: set, polling_interval: float):
+        self.polling_interval = polling_interval
+        self.update(process_names, notification_types)
+
+        self.pending = deque()
+        self.known = procfs.snapshot()
+        self.next_poll = time.monotonic() + self.polling_interval
+
+    def update(self, process_names: set, notification_types: set) -> bool:
+        self.process_names = {n.casefold() for n in process_names}
+
+        self.report_creation = bool({'Creation', 'Operation'} & notification_types)
+        self.report_deletion = bool({'Deletion', 'Operation'} & notification_types)
+        if 'Modification' in notification_types:
+            logging.warning('Modification events are not supported by the proc event source.')
+
+        return True
+
+    def _matches(self, info: procfs.ProcInfo) -> bool:
+        return not self.process_names or info.name.casefold() in self.process_names
+
+    def _poll(self):
+        current = procfs.snapshot(self.known)
+
+        if self.report_creation:
+            for key in current.keys() - self.known.keys():
+                info = current[key]
+                if self._matches(info):
+                    self.pending.append(ProcessEvent(info.name, info.pid, 'Creation', str(info.start_time), info.ppid))
+
+        if self.report_deletion:
+            for key in self.known.keys() - current.keys():
+                info = self.known[key]
+                if self._matches(info):
+                    self.pending.append(ProcessEvent(info.name, info.pid, 'Deletion', str(info.start_time), info.ppid))
+
+        self.known = current
+
+    def next_event(self, timeout_ms: int) -> Optional[ProcessEvent]:
+        deadline = time.monotonic() + timeout_ms * 0.001
+
+        while not self.pending:
+            now = time.monotonic()
+            if now >= self.next_poll:
+                self._poll()
+                self.next_poll = now + self.polling_interval
+                continue
+
+            if now >= deadline:
+                return
+
+            time.sleep(min(self.next_poll, deadline) - now)
+
+        return self.pending.popleft()
+
+
+class ProcEventSource(ProcessEventSource):
+    """ Receive process events on Linux by polling the /proc filesystem """
+    name = 'proc'
+    polling_interval = 1
+
+    def subscribe(self, process_names: set, notification_types: set) -> ProcSubscription:
+        return ProcSubscription(process_names, notification_types, self.polling_interval)
+
+    def enumerate_processes(self, process_names: set) -> List[Tuple[str, int]]:
+        process_names = {n.casefold() for n in process_names}
+        return [(info.name, info.pid) for info in procfs.snapshot().values()
+                if not process_names or info.name.casefold() in process_names]
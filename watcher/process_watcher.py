@@ -3,11 +3,10 @@ import sys
 import threading
 import time
 from queue import Queue, Empty
-from typing import Union
+from typing import Callable, Union
 
-import pythoncom
-import pywintypes
-import wmi
+from .event_source import EventSourceError, EventSubscription, ProcessEvent, ProcessEventSource, \
+    ProcessSnapshot, create_event_source
 
 
 logging.basicConfig(stream=sys.stdout, format='%(asctime)s %(levelname)s: %(message)s',
@@ -17,100 +16,130 @@ logging.basicConfig(stream=sys.stdout, format='%(asctime)s %(levelname)s: %(mess
 class ProcessWatcher(threading.Thread):
     # -- Seconds for WITHIN Parameter
     #    we will receive updates in this interval
-    wmi_polling_interval = 8
+    polling_interval = ProcessEventSource.polling_interval
 
-    # -- Milliseconds for one watch loop
-    #    will timeout if no process event
-    #    was detected within this time and restart the loop
-    wmi_watcher_timeout = wmi_polling_interval * 1000 * 6  # Milliseconds
+    # -- Milliseconds to block waiting for a process event
+    #    before checking the exit event. The subscription stays open in between
+    #    so no events get lost while we check.
+    watcher_timeout = 250  # Milliseconds
 
-    # -- Fields we want our query to contain
-    fields = ['TargetInstance', 'ProcessId', 'Name']
+    # -- Seconds between full enumerations of the watched processes
+    #    to reconcile running process state derived from events
+    reconcile_secs = 300
 
-    def __init__(self, process_names: set, queue: Queue, notification_type: str, exit_event: threading.Event):
-        """ Thread to watch for process events. Reports event to the queue until exit event is set.
+    def __init__(self, process_names: set, report: Callable[[Union[ProcessEvent, ProcessSnapshot]], None],
+                 notification_types: set, exit_event: threading.Event, event_source: ProcessEventSource):
+        """ Thread to watch for process events. Reports events until exit event is set.
+            A snapshot of the running watched processes is reported after subscribing and every reconcile_secs.
 
         :param process_names:
-        :param queue:
-        :param notification_type: “creation”, “deletion”, “modification” or “operation”
+        :param report: callable receiving each event and snapshot, will be called from this thread
+        :param notification_types: set of “Creation”, “Deletion”, “Modification” or “Operation”
         :param exit_event:
+        :param event_source: platform specific source of process events
         """
         super(ProcessWatcher, self).__init__()
         self.process_names = process_names
-        self.queue = queue
-        self.notification_type = notification_type
+        self.report = report
+        self.notification_types = notification_types
         self.exit_event = exit_event
+        self.event_source = event_source
+
+        # -- Process names and notification types requested by update_subscription
+        self._update_lock = threading.Lock()
+        self._requested_update = None
+        self._next_snapshot = 0.0
 
     def run(self):
         """ Watch for created processes until exit event is set """
         logging.debug('ProcessWatcher started.')
-        pythoncom.CoInitialize()  # Do not do this in python main thread!
+        self.event_source.thread_init()
         try:
-            logging.info('Started to watch for %s', self.process_names)
+            logging.info('Started to watch for %s - %s', self.notification_types, self.process_names)
             self.watch_loop()
         finally:
-            pythoncom.CoUninitialize()
+            self.event_source.thread_uninit()
 
         logging.debug('ProcessWatcher shutdown.')
 
     def watch_loop(self):
-        # Init WMI module
-        c = wmi.WMI(find_classes=False)
-
-        logging.debug('WQL: %s', self._build_raw_wql_query())
+        subscription = None
 
         # -- Watch in loop
         while not self.exit_event.is_set():
             try:
-                if self.process_names:
-                    p = self.watch_specific(c)
+                # -- Subscribe once and keep the subscription open until we exit
+                #    or the event source reports an error
+                if subscription is None:
+                    subscription = self.event_source.subscribe(self.process_names, self.notification_types)
+                    self._next_snapshot = 0.0
                 else:
-                    p = self.watch_all(c)
+                    subscription = self._apply_update(subscription)
 
-                if p is not None:
-                    logging.debug('Found %s of %s %s', self.notification_type, p.Name, p.ProcessId)
-                    self.queue.put((p.Name, p.ProcessId))
-            except pywintypes.com_error as err:
-                logging.error(err)
+                # -- Enumerate after subscribing, events reported from now on apply on top of the snapshot
+                if time.monotonic() >= self._next_snapshot:
+                    self.report_snapshot()
 
-    def watch_specific(self, c: wmi.WMI) -> Union[None, wmi._wmi_event]:
-        """ Build the WQL query watching only for process names we are interested in """
-        watcher = c.Win32_Process.watch_for(raw_wql=self._build_raw_wql_query(), fields=self.fields)
+                # This will block until timeout
+                event = subscription.next_event(self.watcher_timeout)
 
-        try:
-            # This will block until timeout
-            event = watcher(timeout_ms=self.wmi_watcher_timeout)
-            return event
-        except wmi.x_wmi_timed_out:
-            pass
+                if event is not None:
+                    logging.debug('Found %s of %s %s', event.notification_type, event.name, event.pid)
+                    self.report(event)
+            except EventSourceError as err:
+                logging.error(err)
+                if subscription is not None:
+                    subscription.close()
+                    subscription = None
 
-    def watch_all(self, c: wmi.WMI) -> Union[None, wmi._wmi_event]:
-        """ Let WMI module handle query creation and watch for all processes """
-        watcher = c.Win32_Process.watch_for(self.notification_type)
+                # Do not hammer a failing event source with new subscriptions
+                self.exit_event.wait(self.polling_interval)
 
-        try:
-            # This will block until timeout
-            p = watcher(self.wmi_watcher_timeout)
-            return p
-        except wmi.x_wmi_timed_out:
-            pass
+        if subscription is not None:
+            subscription.close()
 
-    def _build_raw_wql_query(self):
-        """ Build the WQL query based on process names to watch eg:
-            SELECT * FROM __InstanceCreationEvent WITHIN 5 WHERE TargetInstance
-            ISA 'Win32_Process' AND (TargetInstance.Name = 'calc.exe' OR TargetInstance.Name = 'notepad.exe')
+    def report_snapshot(self):
+        processes = self.event_source.enumerate_processes(self.process_names)
+        self.report(ProcessSnapshot(frozenset(n.casefold() for n in self.process_names), tuple(processes)))
+        self._next_snapshot = time.monotonic() + self.reconcile_secs
+
+    def update_subscription(self, process_names: set, notification_types: set):
+        """ Change the watched process names and notification types of the running watcher.
+            May be called from any thread, the update is applied within watcher_timeout.
         """
-        field_list = ", ".join(self.fields)
+        with self._update_lock:
+            self._requested_update = (set(process_names), set(notification_types))
+
+    def _apply_update(self, subscription: EventSubscription) -> EventSubscription:
+        with self._update_lock:
+            update, self._requested_update = self._requested_update, None
+
+        if update is None:
+            return subscription
+
+        process_names, notification_types = update
+        if process_names == self.process_names and notification_types == self.notification_types:
+            # - Requests may have been reverted before they were applied
+            logging.debug('Watched process names and notification types unchanged')
+            return subscription
 
-        where = ''
-        for process_name in self.process_names:
-            where += f"TargetInstance.Name = '{process_name}' OR "
+        logging.info('Updating watch for %s - %s', notification_types, process_names)
+        self.process_names, self.notification_types = process_names, notification_types
+        self._next_snapshot = 0.0
 
-        wql = f"SELECT {field_list} FROM __Instance{self.notification_type}Event WITHIN {self.wmi_polling_interval} " \
-              f"WHERE TargetInstance ISA 'Win32_Process' AND ("
-        wql += f"{where[:-4]})"
+        if subscription.update(process_names, notification_types):
+            return subscription
+
+        # -- Open the new subscription before closing the old one so there is no blind window.
+        #    Events reported by both subscriptions are collapsed by the Watchlet.
+        new_subscription = self.event_source.subscribe(process_names, notification_types)
+        try:
+            while (event := subscription.next_event(0)) is not None:
+                self.report(event)
+        finally:
+            subscription.close()
 
-        return wql
+        return new_subscription
 
 
 def main():
@@ -118,14 +147,16 @@ def main():
     q = Queue()
     start = time.time()
 
-    watcher_thread = ProcessWatcher({'notepad++.exe', 'notepad.exe', 'code.exe'}, q, 'Creation', event)
+    watcher_thread = ProcessWatcher({'notepad++.exe', 'notepad.exe', 'code.exe'}, q.put, {'Creation'}, event,
+                                    create_event_source())
     watcher_thread.start()
 
     while 1:
         try:
             try:
-                p_name, pid = q.get(timeout=ProcessWatcher.wmi_polling_interval)
-                logging.info('Result queue: %s, %s', p_name, pid)
+                result = q.get(timeout=ProcessWatcher.polling_interval)
+                if isinstance(result, ProcessEvent):
+                    logging.info('Result queue: %s, %s', result.name, result.pid)
             except Empty:
                 logging.info('Empty queue')
             if time.time() - start > 10:
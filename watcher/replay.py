@@ -0,0 +1,197 @@
+""" Replay a recorded watcher trace through the Watchlet and TaskManager.
+
+    Tasks are not executed but recorded by a FakeLauncher. Profiles are read from the app database.
+
+        python -m watcher.replay simmon_trace.jsonl --speed 10
+"""
+import argparse
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from shared_modules.launcher import LaunchTracker
+from shared_modules.rules import TaskRule
+from shared_modules.stat_cache import stat_cache
+from shared_modules.taskmanager import TaskManager
+from . import log_listener
+from .event_source import EventSubscription, ProcessEvent, ProcessEventSource, ProcessSnapshot
+from .trace import read_trace
+from .watcher_app import WatcherApp
+from .watchlet import Watchlet
+
+if TYPE_CHECKING:
+    from shared_modules.models import Task
+
+
+class ReplaySubscription(EventSubscription):
+    def __init__(self, source: 'ReplayEventSource', process_names: set, notification_types: set):
+        self.source = source
+        self.update(process_names, notification_types)
+
+    def update(self, process_names: set, notification_types: set) -> bool:
+        self.process_names = {n.casefold() for n in process_names}
+        self.notification_types = set(notification_types)
+        return True
+
+    def _matches(self, event: ProcessEvent) -> bool:
+        if self.process_names and event.name.casefold() not in self.process_names:
+            return False
+        return 'Operation' in self.notification_types or event.notification_type in self.notification_types
+
+    def next_event(self, timeout_ms: int) -> Optional[ProcessEvent]:
+        deadline = time.monotonic() + timeout_ms * 0.001
+
+        while (event := self.source.next_event(deadline)) is not None:
+            if self._matches(event):
+                return event
+
+
+class ReplayEventSource(ProcessEventSource):
+    """ Report the events of a trace file in recorded timing, optionally accelerated by speed """
+    name = 'replay'
+
+    def __init__(self, file: Path, speed: float = 1.0):
+        self.speed = speed
+        self.entries: List[Tuple[float, Union[ProcessEvent, ProcessSnapshot]]] = list(read_trace(file))
+        self.finished = threading.Event()
+
+        # -- Replayed state of running processes pid -> name
+        self._running: Dict[int, str] = dict()
+        self._lock = threading.Lock()
+        self._position = 0
+        self._start: Optional[float] = None
+
+        # -- Apply leading snapshots, they describe the state before the first event
+        while self._position < len(self.entries) and isinstance(self.entries[self._position][1], ProcessSnapshot):
+            self._apply(self.entries[self._position][1])
+            self._position += 1
+
+        self._trace_start = self.entries[self._position][0] if self._position < len(self.entries) else 0.0
+        if self._position >= len(self.entries):
+            self.finished.set()
+
+    def _apply(self, entry: Union[ProcessEvent, ProcessSnapshot]):
+        if isinstance(entry, ProcessSnapshot):
+            self._running = {pid: name for name, pid in entry.processes}
+        elif entry.notification_type == 'Deletion':
+            self._running.pop(entry.pid, None)
+        else:
+            self._running[entry.pid] = entry.name
+
+    def trace_time(self, monotonic_time: float) -> float:
+        """ Convert a monotonic time of this replay into seconds after the first traced event """
+        return (monotonic_time - (self._start or monotonic_time)) * self.speed
+
+    def next_event(self, deadline: float) -> Optional[ProcessEvent]:
+        """ Block until the next traced event is due or the monotonic deadline passed """
+        while True:
+            with self._lock:
+                if self._position >= len(self.entries):
+                    self.finished.set()
+                    due, entry = None, None
+                else:
+                    timestamp, entry = self.entries[self._position]
+                    due = self._start + (timestamp - self._trace_start) / self.speed
+
+                    if due <= time.monotonic():
+                        self._position += 1
+                        self._apply(entry)
+                        if isinstance(entry, ProcessEvent):
+                            return entry
+                        continue
+
+            wait = (due or deadline) - time.monotonic()
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(max(0.0, min(wait, deadline - time.monotonic())))
+
+    def subscribe(self, process_names: set, notification_types: set) -> ReplaySubscription:
+        with self._lock:
+            if self._start is None:
+                self._start = time.monotonic()
+        return ReplaySubscription(self, process_names, notification_types)
+
+    def enumerate_processes(self, process_names: set) -> List[Tuple[str, int]]:
+        process_names = {n.casefold() for n in process_names}
+        with self._lock:
+            return [(name, pid) for pid, name in self._running.items()
+                    if not process_names or name.casefold() in process_names]
+
+
+class TaskLaunch(NamedTuple):
+    time: float
+    task_id: int
+    task_name: str
+    stop: bool
+
+
+class FakeLauncher:
+    """ Record the tasks the TaskManager would execute instead of executing them """
+    def __init__(self):
+        self.launches: List[TaskLaunch] = list()
+
+    def __call__(self, tasks: List[Union['Task', TaskRule]]):
+        for task in tasks:
+            self.launches.append(TaskLaunch(time.monotonic(), task.id, task.name, bool(task.stop)))
+
+
+def replay(file: Path, speed: float = 1.0, settle_secs: float = 15.0, assume_existing: bool = False) \
+        -> Tuple[ReplayEventSource, List[TaskLaunch]]:
+    """ Replay a trace through a Watchlet with the profiles of the app database
+
+    :param file: trace file to replay
+    :param speed: replay speed factor eg. 10 to replay ten times faster than recorded
+    :param settle_secs: seconds to wait for evaluations to finish after the last event
+    :param assume_existing: treat all executables as existing, eg. for traces recorded on another machine
+    """
+    source = ReplayEventSource(file, speed)
+    launcher = FakeLauncher()
+    TaskManager.execute_hook = launcher
+    # -- Fresh launch states with the cooldown passing as fast as the trace time
+    launch_tracker, TaskManager.launch_tracker = TaskManager.launch_tracker, LaunchTracker()
+    TaskManager.launch_tracker.cooldown_secs = LaunchTracker.cooldown_secs / speed
+    stat_cache.assume_existing = assume_existing
+    exit_event = threading.Event()
+    watchlet = None
+
+    try:
+        watchlet = Watchlet(WatcherApp.read_rules(), exit_event, source)
+        watchlet.start()
+        source.finished.wait()
+        exit_event.wait(settle_secs)
+    finally:
+        if watchlet is not None:
+            watchlet.stop()
+            watchlet.join()
+        TaskManager.execute_hook = None
+        TaskManager.launch_tracker = launch_tracker
+        stat_cache.assume_existing = False
+
+    return source, launcher.launches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded watcher trace with a fake task launcher.')
+    parser.add_argument('trace', type=Path, help='trace file recorded with simmon_watcher --trace')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed factor, default: 1.0')
+    parser.add_argument('--settle', type=float, default=15.0,
+                        help='seconds to wait for evaluations after the last event, default: 15')
+    parser.add_argument('--assume-existing', action='store_true',
+                        help='treat all executables as existing, eg. to replay a trace recorded on another machine')
+    args = parser.parse_args()
+
+    source, launches = replay(args.trace, args.speed, args.settle, args.assume_existing)
+
+    for launch in launches:
+        logging.info('+%.2fs %s task #%s %s', source.trace_time(launch.time), 'Stop' if launch.stop else 'Start',
+                     launch.task_id, launch.task_name)
+    logging.info('Replayed %s trace entries, %s tasks executed.', len(source.entries), len(launches))
+
+    # -- Flush the log queue before the interpreter exits
+    log_listener.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable
+
+# -- Returns the evaluation coroutine, it holds the semaphore passed in while it checks and launches tasks
+Evaluation = Callable[[asyncio.Semaphore], Awaitable[bool]]
+
+
+class EvaluationScheduler:
+    """ Run TaskManager evaluations concurrently while evaluations of the same profile run one after another.
+
+        A newer evaluation of a profile supersedes an older one that is still pending: the older evaluation
+        gets cancelled and the newer one starts after it wound down. At most max_concurrent evaluations check and
+        launch tasks at once, evaluations waiting to retry do not count. Needs to be created inside the running
+        event loop.
+    """
+    def __init__(self, max_concurrent: int = 4):
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._evaluations: Dict[Hashable, asyncio.Task] = dict()
+
+        self.submitted = 0
+        self.superseded = 0
+
+    def submit(self, key: Hashable, evaluation: Evaluation) -> asyncio.Task:
+        """ Schedule an evaluation
+
+        :param key: evaluations with the same key aka. profile id are serialized
+        :param evaluation: called with the semaphore limiting concurrent checks once the superseded evaluation
+                           of this key wound down, returns the evaluation coroutine
+        """
+        previous = self._evaluations.get(key)
+        if previous is not None and not previous.done():
+            logging.debug('Evaluation of %s superseded by a newer event.', key)
+            previous.cancel()
+            self.superseded += 1
+
+        task = asyncio.create_task(self._run(key, previous, evaluation))
+        self._evaluations[key] = task
+        self.submitted += 1
+
+        def _remove(t: asyncio.Task):
+            if self._evaluations.get(key) is t:
+                self._evaluations.pop(key)
+
+        task.add_done_callback(_remove)
+        return task
+
+    async def _run(self, key: Hashable, previous: asyncio.Task, evaluation: Evaluation) -> bool:
+        # -- Wait for the superseded evaluation of this key to wind down
+        if previous is not None:
+            await asyncio.wait({previous})
+
+        try:
+            result = await evaluation(self._semaphore)
+        except Exception as e:
+            logging.error('Error evaluating tasks of profile #%s: %s', key, e)
+            return False
+
+        if not result:
+            logging.info('No active Tasks found to execute for profile #%s.', key)
+        return result
+
+    def cancel_all(self):
+        for task in self._evaluations.values():
+            task.cancel()
+
+    def log_stats(self):
+        logging.debug('Evaluation scheduler ran %s evaluations, %s were superseded.', self.submitted, self.superseded)
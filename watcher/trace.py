@@ -0,0 +1,62 @@
+""" Append-only trace files of the events received by the watcher.
+
+    One JSON array per line, either a process event:
+        [timestamp, notification_type, name, pid, parent_pid, creation_date]
+    or a snapshot of the running watched processes:
+        [timestamp, "Snapshot", [casefolded process names], [[name, pid], ...]]
+"""
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, Tuple, Union
+
+from .event_source import ProcessEvent, ProcessSnapshot
+
+SNAPSHOT = 'Snapshot'
+
+
+class TraceRecorder:
+    def __init__(self, file: Path):
+        self.file = file
+        self._lock = threading.Lock()
+        self._f = open(self.file.as_posix(), 'a', encoding='utf-8', buffering=1)
+        logging.info('Recording watcher events to %s', self.file.as_posix())
+
+    def write(self, entry: Union[ProcessEvent, ProcessSnapshot], timestamp: float = None):
+        timestamp = round(timestamp or time.time(), 4)
+
+        if isinstance(entry, ProcessSnapshot):
+            record = [timestamp, SNAPSHOT, sorted(entry.process_names), [list(p) for p in entry.processes]]
+        else:
+            record = [timestamp, entry.notification_type, entry.name, entry.pid, entry.parent_pid,
+                      entry.creation_date]
+
+        with self._lock:
+            self._f.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+
+def read_trace(file: Path) -> Iterator[Tuple[float, Union[ProcessEvent, ProcessSnapshot]]]:
+    """ Read (timestamp, event or snapshot) entries of a trace file, skipping unreadable lines """
+    with open(file.as_posix(), 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+
+            try:
+                record = json.loads(line)
+                if record[1] == SNAPSHOT:
+                    entry = ProcessSnapshot(frozenset(record[2]), tuple((n, pid) for n, pid in record[3]))
+                else:
+                    timestamp, notification_type, name, pid, parent_pid, creation_date = record
+                    entry = ProcessEvent(name, pid, notification_type, creation_date, parent_pid)
+            except (ValueError, IndexError, TypeError) as e:
+                logging.error('Skipping invalid trace line #%s: %s', line_no, e)
+                continue
+
+            yield record[0], entry
@@ -1,85 +1,122 @@
 import logging
 import threading
+import time
 from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
+from typing import Optional
 
+from shared_modules.changelog import read_data_version
 from shared_modules.globals import SHARED_MEMORY_NAME
-from shared_modules.migrate import Session
-from shared_modules.utils import iterate_profiles
+from shared_modules.rules import RuleIndex
+from shared_modules.rules_file import read_rules_file
+from shared_modules.stat_cache import stat_cache
+from shared_modules.taskmanager import TaskManager
+from .event_source import ProcessEventSource, create_event_source
 from .process_watcher import ProcessWatcher
+from .trace import TraceRecorder
 from .watchlet import Watchlet
 
 
 class WatcherApp:
-    def __init__(self, global_exit_event: threading.Event):
+    # -- Seconds between checks of the shared memory state
+    state_poll_secs = 0.25
+
+    def __init__(self, global_exit_event: threading.Event, event_source: ProcessEventSource = None,
+                 trace_file: Path = None):
         self.global_exit_event = global_exit_event
+        self.event_source = event_source or create_event_source()
+        logging.info('Using %s process event source', self.event_source.name)
+
+        # -- Optionally record all received events to a trace file
+        self.recorder = TraceRecorder(trace_file) if trace_file else None
 
-        self.watchlets = list()
+        self.watchlet: Optional[Watchlet] = None
         self.watchlets_exit_event = threading.Event()
 
         self.share = self._create_shared_memory()
+        self._last_read = 0.0
 
     def app_loop(self):
         while not self.global_exit_event.is_set():
-            if self.re_read_requested() or not self.watchlets:
-                # -- Reset Watchlets
-                self.create_watchlets()
+            # -- Retry to find something to watch in the polling interval
+            retry = self.watchlet is None and time.monotonic() - self._last_read > ProcessWatcher.polling_interval
+
+            if self.re_read_requested() or retry:
+                # -- Update or create the Watchlet
+                self._last_read = time.monotonic()
+                self.update_watchlet()
 
                 # -- Communicate running application state
                 self.share.buf[0:4] = b'RUN_'
 
-            self.global_exit_event.wait(ProcessWatcher.wmi_polling_interval)
+            self.global_exit_event.wait(self.state_poll_secs)
 
+        self.stop_watchlet()
         self.share.close()
         self.share.unlink()
-        Session.remove()
-
-    def create_watchlets(self):
-        # -- Stop running watchlets
-        if self.watchlets:
-            logging.debug('Shutting down Watchlets.')
-            self.watchlets_exit_event.set()
-            for watchlet in self.watchlets:
-                watchlet.join(timeout=(ProcessWatcher.wmi_watcher_timeout * 0.0012))
-                del watchlet
-
-            if self.global_exit_event.is_set():
-                logging.debug('Global Exit Event detected. Skipping Watchlet creation.')
-                return
-
-            self.watchlets_exit_event.clear()
 
-        # -- Collect profile processes and categorize by notification_type
-        process_dict = dict()
+        if self.recorder is not None:
+            self.recorder.close()
 
-        # -- Create local session
-        Session()
+    def update_watchlet(self):
+        if self.global_exit_event.is_set():
+            logging.debug('Global Exit Event detected. Skipping Watchlet update.')
+            return
 
-        for profile in iterate_profiles(Session):
-            if not profile.active:
-                continue
+        # -- Only compile the profiles changed since the running rules were read. A re-read request
+        #    without database changes compiles everything, executables may have been installed or removed.
+        current = self.watchlet.rules if self.watchlet is not None and self.watchlet.is_alive() else None
+        if current is not None and read_data_version() == current.data_version:
+            current = None
 
-            logging.info('Profile: %s - %s', profile.id, profile.name)
-            for process in profile.processes:
-                # Skip non existing executables
-                executable_path = Path(process.path) / process.executable
-                if not executable_path.exists() or not process.executable:
-                    continue
-
-                if process.notification_type not in process_dict.keys():
-                    process_dict[process.notification_type] = list()
-
-                process_dict[process.notification_type].append(process)
+        # -- Check executables again
+        stat_cache.invalidate()
+        try:
+            rules = self.read_rules(current)
+        except Exception as e:
+            logging.error('Could not read rules, keeping the current rules: %s', e)
+            return
+
+        if rules is current:
+            logging.debug('Rules unchanged at data version %s', rules.data_version)
+        elif not rules:
+            # -- Nothing to watch
+            self.stop_watchlet()
+        elif self.watchlet is not None and self.watchlet.is_alive():
+            # -- Update the running watchlet in place, events keep flowing during the update
+            self.watchlet.update(rules)
+        else:
+            # -- Create one watchlet multiplexing all notification types Creation/Deletion etc.
+            self.stop_watchlet()
+            self.watchlets_exit_event.clear()
 
-        # -- Remove local session
-        Session.remove()
-        # -- Create a watchlet for each notification type Creation/Deletion etc.
-        for notification_type, process_list in process_dict.items():
-            logging.debug('Creating Watchlet of type: %s', notification_type)
-            watchlet = Watchlet(process_list, notification_type, self.watchlets_exit_event)
-            self.watchlets.append(watchlet)
+            logging.debug('Creating Watchlet of types: %s', ', '.join(rules.notification_types))
+            self.watchlet = Watchlet(rules, self.watchlets_exit_event, self.event_source, self.recorder)
             # Start watching
-            watchlet.start()
+            self.watchlet.start()
+
+    @staticmethod
+    def read_rules(current: RuleIndex = None) -> RuleIndex:
+        """ Compile the rules of active profiles, routing their processes by notification_type.
+            Also collects the executable names of task and condition processes. Reads the rules file
+            exported by the GUI and falls back to the database if it is missing or outdated. The database
+            session is closed after compiling, the watcher only keeps the detached rule snapshot.
+
+        :param current: running rules, only profiles changed since their data version are compiled again
+        """
+        rules = read_rules_file(current=current)
+        if rules is None:
+            rules = TaskManager.load_rules(current)
+        return rules
+
+    def stop_watchlet(self):
+        if self.watchlet is None:
+            return
+
+        logging.debug('Shutting down Watchlet.')
+        self.watchlet.stop()
+        self.watchlet.join(timeout=(ProcessWatcher.watcher_timeout * 0.004))
+        self.watchlet = None
 
     def re_read_requested(self) -> bool:
         """ See if other processes want us to re-read the profile database """
@@ -1,97 +1,196 @@
 import asyncio
 import logging
 import threading
-import time
-from queue import Empty, Queue
-from typing import List, Iterable
+from typing import Callable, FrozenSet, Optional, Union
 
-import pythoncom
-
-from shared_modules.models import Process
+from shared_modules.process_table import ProcessTable
+from shared_modules.rules import RuleIndex
+from watcher.dedup import EventDeduplicator
+from watcher.event_source import ProcessEvent, ProcessEventSource, ProcessSnapshot
 from watcher.process_watcher import ProcessWatcher
+from watcher.scheduler import EvaluationScheduler
+from watcher.trace import TraceRecorder
 from shared_modules.taskmanager import TaskManager
 
 
 class Watchlet(threading.Thread):
-    watcher_timeout_secs = ProcessWatcher.wmi_watcher_timeout * 0.001
-
-    def __init__(self, process_list: List[Process], notification_type: str, exit_event: threading.Event):
+    # -- Seconds to remember events for deduplication
+    dedup_ttl_secs = ProcessWatcher.polling_interval * 6
+
+    # -- Maximum number of profile evaluations running at once
+    max_concurrent_evaluations = 4
+
+    def __init__(self, rules: RuleIndex, exit_event: threading.Event, event_source: ProcessEventSource,
+                 recorder: TraceRecorder = None):
+        """ Watch for events of all notification types with a single watcher thread and
+            route them to the TaskManager. Keeps a table of the running tracked processes for
+            the TaskManager condition checks.
+
+        :param rules: compiled profile rules to route events with
+        :param exit_event:
+        :param event_source: platform specific source of process events
+        :param recorder: optional recorder writing every received event to a trace file
+        """
         super(Watchlet, self).__init__()
-        self.process_list = process_list
-        self.notification_type = notification_type
         self.exit_event = exit_event
+        self.event_source = event_source
+        self.recorder = recorder
+
+        # -- Compiled rules routing casefolded executable names and the notification types we are
+        #    interested in to the ids of the profiles watching them
+        self.rules = rules
+        self.process_names, self.notification_types = set(), set()
+        self._set_rules(rules)
+
+        self.process_table = ProcessTable()
+
+        # -- Event loop and queue receiving events from the watcher thread, set while running
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._watcher_thread: Optional[ProcessWatcher] = None
+
+    def _set_rules(self, rules: RuleIndex):
+        # -- Watch creation and deletion of tracked processes to keep the process table current
+        self.process_names = set(rules.process_names | rules.tracked_names)
+        self.notification_types = set(rules.notification_types) | {'Creation', 'Deletion'}
+        # Replace rules at once, the watch loop picks up the new rules with the next event
+        self.rules = rules
+
+    def update(self, rules: RuleIndex):
+        """ Update watched processes of the running Watchlet without restarting it.
+            May be called from any thread.
+
+        :param rules: compiled profile rules to route events with
+        """
+        old_routes, old_watch = self.rules.routes, (self.process_names, self.notification_types)
+        self._set_rules(rules)
+        new_routes = self.rules.routes
+
+        logging.info('Updating Watchlet routes. Added: %s Removed: %s',
+                     new_routes - old_routes or '-', old_routes - new_routes or '-')
+
+        # -- Keep the subscription if the profile changes did not change what is watched
+        if (self.process_names, self.notification_types) == old_watch:
+            return
+
+        watcher_thread = self._watcher_thread
+        if watcher_thread is not None:
+            watcher_thread.update_subscription(self.process_names, self.notification_types)
 
     def run(self) -> None:
-        process_names = {p.executable for p in self.process_list}
+        # -- Wait for a watch result matching a profile
+        self.event_source.thread_init()
+        try:
+            asyncio.run(self.watch_loop())
+        except Exception as e:
+            logging.fatal('Error running watchlet watch loop: %s', e)
+        finally:
+            self.event_source.thread_uninit()
+
+    def stop(self):
+        """ Request the Watchlet to exit, may be called from any thread """
+        self.exit_event.set()
+        self._put_threadsafe(None)
+
+    def _put_threadsafe(self, event: Union[None, ProcessEvent, ProcessSnapshot]):
+        """ Hand an event from another thread over to the watch loop """
+        loop, queue = self._loop, self._queue
+        if loop is None or queue is None:
+            return
+
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+        except RuntimeError:
+            # Event loop already closed
+            pass
+
+    async def watch_loop(self):
+        self._loop, self._queue = asyncio.get_running_loop(), asyncio.Queue()
 
         # -- Create a watcher thread
-        watcher_thread, watcher_queue, watcher_exit_event = self._create_watcher(process_names, self.notification_type)
+        watcher_thread, watcher_exit_event = self._create_watcher(
+            self.process_names, self._put_threadsafe, self.notification_types, self.event_source)
+        self._watcher_thread = watcher_thread
         watcher_thread.start()
 
-        # -- Create a second watcher thread to avoid missing events when WMI module returns from timeout
-        #    Start second thread after half the wmi timeout
-        time.sleep(self.watcher_timeout_secs / 2)
-        watcher_thread_two, _, _ = self._create_watcher(process_names, self.notification_type,
-                                                        watcher_queue, watcher_exit_event)
-        watcher_thread_two.start()
+        logging.debug('Started Watchlet for %s - %s', self.notification_types, self.process_names)
 
-        logging.debug('Started Watchlet for %s - %s', self.notification_type, process_names)
+        # -- Let condition checks look up running processes in our table
+        TaskManager.process_table = self.process_table
 
-        # -- Wait for a watch result matching a profile
-        pythoncom.CoInitialize()  # Do not do this in python main thread!
         try:
-            asyncio.run(self.watch_loop(watcher_queue))
-        except Exception as e:
-            logging.fatal('Error running watchlet watch loop: %s', e)
+            await self.dispatch_events(self._queue)
         finally:
-            pythoncom.CoUninitialize()
+            TaskManager.process_table = None
 
-        # -- Join watcher thread
-        self.end_watcher((watcher_thread, watcher_thread_two), watcher_exit_event)
+            # -- Join watcher thread
+            self._loop, self._queue, self._watcher_thread = None, None, None
+            self.end_watcher(watcher_thread, watcher_exit_event)
 
-    async def watch_loop(self, watcher_queue: Queue):
-        last_event_time = time.time() - self.watcher_timeout_secs
+    async def dispatch_events(self, queue: asyncio.Queue):
+        dedup = EventDeduplicator(self.dedup_ttl_secs)
+        scheduler = EvaluationScheduler(self.max_concurrent_evaluations)
 
-        # - Prepare empty check_tasks task to create an awaitable dummy
-        #   for the first loop iteration
-        async def empty_task():
-            return False
-        check_tasks_task = asyncio.create_task(empty_task())
+        while not self.exit_event.is_set():
+            # -- Wait without blocking the event loop, TaskManager tasks progress meanwhile
+            event = await queue.get()
 
-        # -- Break queue watching in between watcher restarts
-        #    to listen for a global exit event
-        queue_timeout = self.watcher_timeout_secs / 2
+            # -- None is put to the queue by stop requests
+            if event is None:
+                continue
 
-        while not self.exit_event.is_set():
-            try:
-                process_name, process_id = watcher_queue.get(timeout=queue_timeout)
-                logging.debug('Watchlet received queue entry: %s, %s', process_name, process_id)
+            if self.recorder is not None:
+                self.recorder.write(event)
+
+            if isinstance(event, ProcessSnapshot):
+                self.process_table.reconcile(event.process_names, event.processes)
+                continue
 
-                # Await last task result
-                if not await check_tasks_task:
-                    logging.info('No active Tasks found to execute in last run.')
+            logging.debug('Watchlet received queue entry: %s, %s', event.name, event.pid)
+            self.process_table.apply(event.notification_type, event.name, event.pid)
+            if event.notification_type == 'Deletion':
+                TaskManager.launch_tracker.process_exited(event.pid)
 
-                # Skip doubled events from the two threads within watcher timeout
-                if (time.time() - last_event_time) < self.watcher_timeout_secs:
-                    logging.debug('Skipping doubled event occurrence of %s', process_name)
-                    continue
+            # Skip events of notification types not requested for this executable
+            profile_ids = self.route(event.name, event.notification_type)
+            if not profile_ids:
+                logging.debug('Skipping unrouted %s event of %s', event.notification_type, event.name)
+                continue
+
+            # Skip doubled occurrences of the very same process event
+            if dedup.is_duplicate(event):
+                logging.debug('Skipping doubled event occurrence of %s %s', event.name, event.pid)
+                continue
+
+            # -- Evaluate each hit profile on its own, unrelated profiles do not wait for each other
+            for profile_id in profile_ids:
+                scheduler.submit(profile_id, self._evaluation(event, profile_id, self.rules))
+
+        scheduler.cancel_all()
+        dedup.log_stats()
+        scheduler.log_stats()
+
+    @staticmethod
+    def _evaluation(event: ProcessEvent, profile_id: int, rules: RuleIndex):
+        # Evaluate with the rules the event was routed with, even if a reload replaces them meanwhile
+        def evaluation(slot: asyncio.Semaphore):
+            return TaskManager.find_tasks(event.name, event.pid, [profile_id], rules, slot)
+        return evaluation
 
-                last_event_time = time.time()
-                check_tasks_task = asyncio.create_task(TaskManager.find_tasks(process_name, process_id))
-            except Empty:
-                pass
+    def route(self, process_name: str, notification_type: str) -> FrozenSet[int]:
+        """ Return the ids of the profiles watching for this event """
+        return self.rules.route(process_name, notification_type)
 
     @staticmethod
-    def _create_watcher(process_names: set, notification_type: str, queue: Queue = None, event: threading.Event = None):
-        event = event or threading.Event()
-        queue = queue or Queue()
-        watcher_thread = ProcessWatcher(process_names, queue, notification_type, event)
-        return watcher_thread, queue, event
+    def _create_watcher(process_names: set, report: Callable[[ProcessEvent], None], notification_types: set,
+                        event_source: ProcessEventSource):
+        event = threading.Event()
+        watcher_thread = ProcessWatcher(process_names, report, notification_types, event, event_source)
+        return watcher_thread, event
 
     @staticmethod
-    def end_watcher(watcher_threads: Iterable[ProcessWatcher],  watcher_exit_event):
+    def end_watcher(watcher_thread: ProcessWatcher,  watcher_exit_event):
         """ Join a running watcher thread """
         logging.info('Watchlet stop requested. Stopping watcher thread blocking.')
         watcher_exit_event.set()
-        for thread in watcher_threads:
-            thread.join(timeout=(thread.wmi_watcher_timeout * 0.001))
+        watcher_thread.join(timeout=(watcher_thread.watcher_timeout * 0.002))
@@ -0,0 +1,57 @@
+""" Show which tasks would be started or stopped for a hypothetical set of running processes.
+
+    Evaluates the profiles of the app database with the compiled watcher rules, nothing gets launched.
+
+        python -m watcher.whatif --event rFactor2.exe Creation --running vrserver.exe obs64.exe
+        python -m watcher.whatif --profile 1 --running vrserver.exe --repeat 10000
+"""
+import argparse
+import json
+import logging
+import time
+
+from shared_modules.taskmanager import TaskManager
+from . import log_listener
+
+
+def main():
+    parser = argparse.ArgumentParser(description='What-if evaluation of the SimMon profile tasks.')
+    parser.add_argument('--event', nargs=2, metavar=('EXECUTABLE', 'TYPE'), default=None,
+                        help='triggering event eg. rFactor2.exe Creation. Evaluate all tasks if omitted.')
+    parser.add_argument('--running', nargs='*', default=list(), metavar='EXECUTABLE',
+                        help='executable names of the running processes')
+    parser.add_argument('--profile', type=int, action='append', default=None, help='profile id, may be repeated')
+    parser.add_argument('--json', action='store_true', help='print the verdicts as JSON')
+    parser.add_argument('--repeat', type=int, default=1, help='repeat the evaluation to measure its rate')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rules = TaskManager.load_rules()
+    event = tuple(args.event) if args.event else None
+
+    start = time.perf_counter()
+    for _ in range(max(1, args.repeat)):
+        verdicts = TaskManager.evaluate(args.profile, args.running, event, rules, explain=args.repeat <= 1)
+    elapsed = time.perf_counter() - start
+
+    if args.repeat > 1:
+        verdicts = TaskManager.evaluate(args.profile, args.running, event, rules)
+
+    if args.json:
+        print(json.dumps([v._asdict() for v in verdicts], indent=2))
+    else:
+        for v in verdicts:
+            print(f'Profile #{v.profile_id} Task #{v.task_id} {v.task_name}: {v.action or "-"} ({v.reason})')
+            for executable, required, running, met in v.conditions:
+                print(f'    {"met" if met else "NOT met"}: {executable} should {"" if required else "not "}run, '
+                      f'{"is running" if running else "is not running"}')
+
+    if args.repeat > 1:
+        print(f'{args.repeat} evaluations in {elapsed:.3f}s, {args.repeat / elapsed:.0f} evaluations/s')
+
+    # -- Flush the log queue before the interpreter exits
+    log_listener.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+import pythoncom
+import pywintypes
+import wmi
+
+from .event_source import EventSourceError, EventSubscription, ProcessEvent, ProcessEventSource
+
+
+class WmiSubscription(EventSubscription):
+    # -- Fields we want our query to contain
+    fields = ['TargetInstance', 'ProcessId', 'Name']
+
+    # -- Intrinsic event classes reported for each notification type
+    event_types = {'Creation': {'Creation'}, 'Deletion': {'Deletion'}, 'Modification': {'Modification'},
+                   'Operation': {'Creation', 'Deletion', 'Modification'}}
+
+    def __init__(self, c: wmi.WMI, process_names: set, notification_types: set, polling_interval: int):
+        self.event_type_set = self.get_event_types(notification_types)
+
+        # Build one WQL query for all notification types
+        # optionally watching only for process names we are interested in
+        wql = self.build_raw_wql_query(process_names, self.event_type_set, polling_interval)
+        logging.debug('WQL: %s', wql)
+
+        try:
+            self.watcher = c.Win32_Process.watch_for(raw_wql=wql, fields=self.fields)
+        except pywintypes.com_error as err:
+            raise EventSourceError(err)
+
+    def close(self):
+        # Releasing the event source object cancels the WMI event query
+        self.watcher = None
+
+    @classmethod
+    def get_event_types(cls, notification_types: set) -> set:
+        event_type_set = set()
+        for notification_type in notification_types:
+            event_type_set.update(cls.event_types.get(notification_type, set()))
+        return event_type_set
+
+    def next_event(self, timeout_ms: int) -> Optional[ProcessEvent]:
+        try:
+            # This will block until timeout
+            p = self.watcher(timeout_ms=timeout_ms)
+        except wmi.x_wmi_timed_out:
+            return
+        except pywintypes.com_error as err:
+            raise EventSourceError(err)
+
+        # wmi reports the intrinsic event class eg. 'creation' for __InstanceCreationEvent
+        notification_type = (p.event_type or '').capitalize()
+        return ProcessEvent(p.Name, p.ProcessId, notification_type, str(p.CreationDate or ''),
+                            p.ParentProcessId or 0)
+
+    @classmethod
+    def build_raw_wql_query(cls, process_names: set, event_type_set: set, polling_interval: int) -> str:
+        """ Build the WQL query based on process names and event types to watch eg:
+            SELECT * FROM __InstanceOperationEvent WITHIN 5 WHERE
+            (__CLASS = '__InstanceCreationEvent' OR __CLASS = '__InstanceDeletionEvent') AND TargetInstance
+            ISA 'Win32_Process' AND (TargetInstance.Name = 'calc.exe' OR TargetInstance.Name = 'notepad.exe')
+        """
+        field_list = ", ".join(cls.fields)
+
+        if len(event_type_set) == 1:
+            event_class = f'__Instance{next(iter(event_type_set))}Event'
+            where = ''
+        else:
+            # Modification events fire constantly, only ask for them if someone is interested
+            event_class = '__InstanceOperationEvent'
+            where = ' OR '.join(f"__CLASS = '__Instance{t}Event'" for t in sorted(event_type_set))
+            where = f'({where}) AND '
+
+        wql = f"SELECT {field_list} FROM {event_class} WITHIN {polling_interval} " \
+              f"WHERE {where}TargetInstance ISA 'Win32_Process'"
+
+        if process_names:
+            names = ' OR '.join(f"TargetInstance.Name = '{process_name}'" for process_name in sorted(process_names))
+            wql += f" AND ({names})"
+
+        return wql
+
+
+class WmiEventSource(ProcessEventSource):
+    """ Receive process events from Windows Management Instrumentation """
+    name = 'wmi'
+
+    def __init__(self):
+        # WMI connections can not be shared between COM apartments aka. threads
+        self._local = threading.local()
+
+    def thread_init(self):
+        pythoncom.CoInitialize()  # Do not do this in python main thread!
+
+    def thread_uninit(self):
+        self._local.connection = None
+        pythoncom.CoUninitialize()
+
+    def _connection(self) -> wmi.WMI:
+        c = getattr(self._local, 'connection', None)
+        if c is None:
+            c = wmi.WMI(find_classes=False)
+            self._local.connection = c
+        return c
+
+    def subscribe(self, process_names: set, notification_types: set) -> WmiSubscription:
+        return WmiSubscription(self._connection(), process_names, notification_types, self.polling_interval)
+
+    def enumerate_processes(self, process_names: set) -> List[Tuple[str, int]]:
+        wql = 'SELECT Name, ProcessId FROM Win32_Process'
+        if process_names:
+            wql += ' WHERE ' + ' OR '.join(f"Name = '{process_name}'" for process_name in sorted(process_names))
+
+        try:
+            return [(p.Name, p.ProcessId) for p in self._connection().query(wql)]
+        except pywintypes.com_error as err:
+            raise EventSourceError(err)